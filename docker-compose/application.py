@@ -9,7 +9,7 @@ application information when changes from the user are received.
     Andrei Răduță andrei.raduta11@gmail.com
 """
 
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 from dash.dependencies import Input, Output, State
 
@@ -25,7 +25,8 @@ application = DashApplication()
 @application.callback(
     [
         Output('symbols_time', 'children'),
-        Output('symbols_datatable', 'data')
+        Output('symbols_datatable', 'data'),
+        Output('symbols_generation', 'data')
     ],
     [
         Input('symbols_list_size', 'value'),
@@ -34,7 +35,8 @@ application = DashApplication()
         Input('symbols_datatable', 'data_timestamp')
     ],
     [
-        State('symbols_datatable', 'data')
+        State('symbols_datatable', 'data'),
+        State('symbols_generation', 'data')
     ]
 )
 def symbols_datatable_callback(
@@ -42,8 +44,9 @@ def symbols_datatable_callback(
     invest_amount,
     transaction_fee,
     symbols_data_timestamp,
-    symbols_data
-) -> List[Dict]:
+    symbols_data,
+    symbols_generation
+) -> Tuple[str, List[Dict], int]:
     """
         This callback runs whenever the user changes data in the Financials or
     Symbols DataTables. This method interacts with the Collector and Calculator
@@ -55,22 +58,36 @@ def symbols_datatable_callback(
         This representation is also used in Application object, so the return
     value will be its inner list of symbols with their details.
     """
-    # If the size of the list has changed, get the information of the symbols.
+    # At startup, wait for the symbols collected in background, instead of
+    # collecting them here too.
+    application.symbols_collected.wait()
+
+    # If the size of the list has changed, collect the symbols again. The
+    # collection runs without the lock, so the other callbacks are not blocked
+    # meanwhile; only its result is published under the lock.
     if len(application.get_symbols_list()) != symbols_list_size:
         application.collect_symbols_data(symbols_list_size)
+        symbols_data = None
 
-    elif symbols_data:
-        application.set_symbols_list(symbols_list=symbols_data)
-
-    application.set_invest_amount(invest_amount)
-    application.set_transaction_fee(transaction_fee)
+    # The symbols can be replaced from the background collection. Keep them
+    # until the table and its time are returned.
+    with application.symbols_lock:
+        if symbols_data:
+            application.set_symbols_list(
+                symbols_list=symbols_data, generation=symbols_generation
+            )
 
-    application.calculate_orders()
+        application.set_invest_amount(invest_amount)
+        application.set_transaction_fee(transaction_fee)
 
-    return application.get_symbols_time(), application.get_symbols_list()
+        application.calculate_orders()
 
+        return (
+            application.get_symbols_time(),
+            application.get_symbols_list(),
+            application.get_symbols_generation()
+        )
 
-application.collect_symbols_data()
 
 application.html_init_layout()
 
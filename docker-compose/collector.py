@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+
+"""
+    The module contains methods to collect data about the symbols of the BET
+Index from the BVB and Tradeville websites.
+
+    The session and the cache of the pages are created once, for all the
+collections made by the process. Each page is parsed only until the table
+read from it is complete.
+
+    Andrei Răduță andrei.raduta11@gmail.com
+"""
+
+
+import concurrent.futures
+import functools
+import gzip
+import hashlib
+import os
+import tempfile
+import time
+import typing
+import zlib
+
+import httpx
+from lxml.etree import HTMLPullParser
+from lxml.html import HtmlElement, HtmlElementClassLookup
+
+
+SYMBOLS_LIST_SIZE = 17
+
+
+BVB_URL: str = "https://www.bvb.ro/FinancialInstruments/Indices/IndicesProfiles.aspx"
+# The table with the symbols is the tbody inside the element with this id.
+BVB_TABLE_TAG: str = "tbody"
+BVB_TABLE_ID: str = "gvC"
+
+
+TRADEVILLE_URL: str = "https://www.tradeville.eu/actiuni/actiuni-"
+# The table with the details of the symbol is the first div of this class.
+TRADEVILLE_TABLE_TAG: str = "div"
+TRADEVILLE_TABLE_CLASS: str = "quotationTblLarge"
+
+# Used to remove the percent signs and the thousands separators from numbers.
+NUMBER_SYMBOLS: typing.Dict[int, None] = str.maketrans("", "", "%,")
+
+
+REQUEST_TIMEOUT: int = 30
+
+# The maximum number of Tradeville pages requested at the same time.
+MAX_WORKERS: int = 8
+
+# Only a few tables are read from each page, so skip the ids and comments.
+HTML_PARSER_OPTIONS: typing.Dict[str, bool] = {
+    "collect_ids": False,
+    "remove_comments": True,
+    "remove_pis": True,
+}
+# The pages are given to the parser in chunks of this size, so the parsing
+# stops soon after the searched table ends.
+CHUNK_SIZE: int = 16 * 1024
+
+# The fetched pages are kept on disk, so the next collections are faster.
+CACHE_DIRECTORY: str = "cache"
+CACHE_MAX_AGE: int = 10 * 60
+
+HEADERS: typing.Dict[str, str] = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.3",
+    "Accept-Encoding": "br, gzip, deflate",
+}
+
+# Reuse the connections (keep-alive) to BVB and Tradeville. With HTTP/2 the
+# Tradeville requests are multiplexed over a single connection. Unlike
+# requests, httpx does not follow the redirects unless it is asked to.
+SESSION: httpx.Client = httpx.Client(
+    headers=HEADERS,
+    follow_redirects=True,
+    http2=True,
+    limits=httpx.Limits(max_connections=16),
+    timeout=REQUEST_TIMEOUT,
+)
+
+
+def collect_symbols_data(
+    symbols_list_size: int = SYMBOLS_LIST_SIZE, max_age: int = CACHE_MAX_AGE
+) -> typing.List[typing.Dict]:
+    """
+    Get the details of the *specified* first elements of the BET Index.
+    Use the websites of the Bucharest Stock Exchange and Tradeville.
+
+    There are two steps. The result consists of a list of dictionaries.
+    The keys are represented by the union of the following:
+    1) Get the list of symbols with some information from BVB.
+        0. symbol
+        1. company
+        2. shares
+        3. price
+        4. free_float_factor
+        5. representation_factor
+        6. price_correction_factor
+        7. weight
+
+    2) Get more details about every symbol from Tradeville website.
+        1.  last_price
+        3.  variation
+        5.  open_price
+        7.  max/min_price
+        9.  medium_price
+        11. volume
+        13. dividend_yield
+
+    The number before each key is the index of it in the raw data.
+
+    The pages fetched in the last max_age seconds are read from the cache.
+    """
+    symbols_list: typing.List[typing.Dict] = []
+
+    # Get the list of symbols from the Bucharest Stock Exchange website.
+    bvb_table = get_html_table(BVB_URL, BVB_TABLE_TAG, is_bvb_table, max_age=max_age)
+
+    # Extract the data of each cell (HTML TD) from each row (HTML TR).
+    bvb_rows = [
+        [data.text_content().strip() for data in bvb_row]
+        for bvb_row in bvb_table[:symbols_list_size]
+    ]
+
+    # Get more information from Tradeville about all the symbols at the
+    # same time. The threads share the session (and its connections).
+    with concurrent.futures.ThreadPoolExecutor(MAX_WORKERS) as executor:
+        tradeville_tables = list(
+            executor.map(
+                functools.partial(
+                    get_html_table,
+                    tag=TRADEVILLE_TABLE_TAG,
+                    predicate=is_tradeville_table,
+                    max_age=max_age,
+                ),
+                [TRADEVILLE_URL + bvb_row[0] for bvb_row in bvb_rows],
+            )
+        )
+
+    for bvb_row, tradeville_table in zip(bvb_rows, tradeville_tables):
+        # Select only the first column from the Tradeville info table.
+        if tradeville_table is None:
+            continue
+
+        # Read only the values (the odd cells), not the labels of the table.
+        (
+            last_price,
+            variation,
+            open_price,
+            max_min_price,
+            medium_price,
+            volume,
+            dividend_yield,
+        ) = [data.text_content().strip() for data in tradeville_table[1:14:2]]
+
+        max_price, min_price = map(to_float, max_min_price.split("/", 1))
+
+        # Some yields are 'n/a'.
+        try:
+            dividend_yield = to_float(dividend_yield)
+        except Exception:
+            dividend_yield = 0
+
+        # Build the list of symbols.
+        symbols_list.append(
+            {
+                "symbol": bvb_row[0],
+                "weight": float(bvb_row[7]) / 100.0,
+                "open_price": to_float(open_price),
+                "buy_price": to_float(last_price),
+                "variation": to_float(variation),
+                "medium_price": to_float(medium_price),
+                "min_price": min_price,
+                "max_price": max_price,
+                "dividend_yield": dividend_yield,
+                "volume": to_int(volume),
+                "shares": to_int(bvb_row[2]),
+                "company": bvb_row[1],
+                "free_float_factor": float(bvb_row[4]),
+                "representation_factor": float(bvb_row[5]),
+                "price_correction_factor": float(bvb_row[6]),
+            }
+        )
+
+    return symbols_list
+
+
+def to_float(text: str) -> float:
+    return float(text.translate(NUMBER_SYMBOLS))
+
+
+def to_int(text: str) -> int:
+    return int(text.translate(NUMBER_SYMBOLS))
+
+
+def is_bvb_table(element: HtmlElement) -> bool:
+    return any(
+        ancestor.get("id") == BVB_TABLE_ID for ancestor in element.iterancestors()
+    )
+
+
+def is_tradeville_table(element: HtmlElement) -> bool:
+    return element.get("class") == TRADEVILLE_TABLE_CLASS
+
+
+def get_html_table(
+    url: str,
+    tag: str,
+    predicate: typing.Callable[[HtmlElement], bool],
+    max_age: int = CACHE_MAX_AGE,
+) -> typing.Optional[HtmlElement]:
+    """
+    Get the HTML page from an URL and return its first element with the tag
+    for which the predicate is true, or None if there is no such element.
+
+    The page is read from the cache if it was saved in the last max_age
+    seconds. Otherwise, it is fetched and the cache file is overwritten.
+
+    If the response failed, an Exception will be raised.
+    """
+    cache_path = os.path.join(
+        CACHE_DIRECTORY, hashlib.sha1(url.encode()).hexdigest() + ".html.gz"
+    )
+
+    try:
+        if time.time() - os.path.getmtime(cache_path) < max_age:
+            with open(cache_path, "rb") as cache_file:
+                return find_html_element(
+                    gzip.decompress(cache_file.read()), tag, predicate
+                )
+    except (OSError, EOFError, zlib.error):
+        # The page is not in the cache yet, or its file is corrupt.
+        pass
+
+    response = SESSION.get(url)
+    response.raise_for_status()
+
+    # Write the page to a temporary file first, so the readers (from other
+    # threads or processes) never see a partially written cache file.
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=CACHE_DIRECTORY, suffix=".tmp", delete=False
+    ) as cache_file:
+        cache_file.write(gzip.compress(response.content))
+    os.replace(cache_file.name, cache_path)
+
+    return find_html_element(response.content, tag, predicate)
+
+
+def find_html_element(
+    content: bytes, tag: str, predicate: typing.Callable[[HtmlElement], bool]
+) -> typing.Optional[HtmlElement]:
+    """
+    Parse the HTML content incrementally and stop at the first element with
+    the tag for which the predicate is true. The element is complete when its
+    end event is read, so the rest of the page is not parsed.
+    """
+    parser = HTMLPullParser(events=("end",), tag=tag, **HTML_PARSER_OPTIONS)
+    parser.set_element_class_lookup(HtmlElementClassLookup())
+
+    for offset in range(0, len(content), CHUNK_SIZE):
+        parser.feed(content[offset : offset + CHUNK_SIZE])
+
+        for _, element in parser.read_events():
+            if predicate(element):
+                return element
+
+    parser.close()
+    for _, element in parser.read_events():
+        if predicate(element):
+            return element
+
+    return None
@@ -18,16 +18,32 @@
 
 
 import datetime
+import functools
+import logging
+import operator
+import os
+import pickle
+import tempfile
+import threading
+import time
 import typing
 
+import numpy as np
 import pytz
-import requests
 from dash import Dash
-from dash_core_components import Input, Link
+from dash_core_components import Input, Link, Store
 from dash_html_components import H1, H2, B, Div, I, Li, Ol, Table, Td, Tr, Ul
 from dash_table import DataTable
 from dash_table.Format import Format, Scheme
-from lxml.html import HtmlElement, fromstring
+
+import collector
+
+try:
+    from numba import njit
+except ImportError:
+    # Without Numba, the kernels run as plain Python functions.
+    def njit(*args, **kwargs):
+        return lambda function: function
 
 
 SYMBOLS_LIST_SIZE = 17
@@ -36,13 +52,187 @@ INVEST_AMOUNT = 1000
 TRANSACTION_FEE = 0.71
 MINIMUM_ORDER_VALUE = 270
 
+TIMEZONE: datetime.tzinfo = pytz.timezone("Europe/Bucharest")
+TIME_FORMAT: str = "%Y-%m-%d %H:%M:%S"
+
+
+# The steps of the calculation are logged only at the DEBUG level.
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+# The last collected symbols, used when the application starts.
+SYMBOLS_FILE_NAME: str = os.path.join(collector.CACHE_DIRECTORY, "symbols-data.pickle")
+
+
+@functools.lru_cache(maxsize=None)
+def get_number_format(precision: int) -> Format:
+    """
+    Get the fixed point format of the numbers, shared by the cells with the same
+    precision.
+    """
+    return Format(precision=precision, scheme=Scheme.fixed)
+
+
+def get_number_datatable_cell(
+    id: str,
+    name: str,
+    editable: bool = False,
+    precision: int = 0,
+    default: int = 0,
+) -> typing.Dict[str, typing.Any]:
+    """
+    Create a Dash DataTable cell with type number.
+    """
+    return {
+        "editable": editable,
+        "id": id,
+        "format": get_number_format(precision),
+        "name": name,
+        "on_change": {"failure": "default"},
+        "validation": {"default": default},
+        "type": "numeric",
+    }
+
+
+# The columns of the symbols table do not change, so they are built once.
+SYMBOLS_DATATABLE_COLUMNS: typing.List[typing.Dict[str, typing.Any]] = [
+    {
+        "id": "symbol",
+        "name": "Symbol",
+        "editable": False,
+        "type": "text",
+    },
+    get_number_datatable_cell(
+        id="current_quantity",
+        name="Current Quantity",
+        editable=True,
+    ),
+    get_number_datatable_cell(
+        id="variation",
+        name="Price Variation (%)",
+        precision=4,
+    ),
+    get_number_datatable_cell(
+        id="medium_price",
+        name="Medium Price (RON)",
+        precision=4,
+    ),
+    get_number_datatable_cell(
+        id="buy_price",
+        name="Buy Price (RON)",
+        editable=True,
+        precision=4,
+    ),
+    get_number_datatable_cell(
+        id="buy_quantity",
+        name="Buy Quantity",
+    ),
+    get_number_datatable_cell(
+        id="order_value",
+        name="Order Value (RON)",
+        precision=2,
+    ),
+]
+
+
+@njit(cache=True)
+def distribute_remainder(
+    orders: np.ndarray, has_order: np.ndarray, value: float, total_value: float
+) -> float:
+    """
+    Distribute the value to the orders that are still placed, proportionally to
+    their values, whose sum is total_value. The orders are updated in place.
+
+    Return the new sum of the placed orders, so it is not summed again.
+    """
+    if value:
+        for index in range(orders.shape[0]):
+            if has_order[index]:
+                orders[index] += value * (orders[index] / total_value)
+
+    return total_value + value
+
+
+@njit(cache=True)
+def sum_orders(orders: np.ndarray, has_order: np.ndarray) -> float:
+    """
+    Sum the orders that are still placed.
+    """
+    total_value = 0.0
+    for index in range(orders.shape[0]):
+        if has_order[index]:
+            total_value += orders[index]
+
+    return total_value
+
+
+@njit(cache=True)
+def eliminate_orders(
+    prices: np.ndarray,
+    orders: np.ndarray,
+    has_order: np.ndarray,
+    weight_order: np.ndarray,
+    minimum_order_value: float,
+) -> None:
+    """
+    Eliminate the orders that cannot be done because of fee, going ascending by
+    weight (the indices in weight_order), until the first order that can be done.
+    The money of an eliminated order is distributed to the others.
+    """
+    # The sum of the placed orders is kept running, instead of summed again.
+    total_value = sum_orders(orders, has_order)
+
+    for index in weight_order:
+        value = orders[index] if has_order[index] else 0.0
+
+        # Make transaction fee-efficient.
+        if (value // prices[index]) * prices[index] <= minimum_order_value:
+            has_order[index] = False
+            total_value = distribute_remainder(
+                orders, has_order, value, total_value - value
+            )
+        else:
+            break
+
+
+@njit(cache=True)
+def place_orders(
+    prices: np.ndarray,
+    orders: np.ndarray,
+    has_order: np.ndarray,
+    price_order: np.ndarray,
+    minimum_order_value: float,
+) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate the buy quantities and the order values (without the fee), going
+    descending by price (the indices in price_order). The remainder of each
+    purchase is distributed to the orders not done yet.
+    """
+    buy_quantities = np.zeros(prices.shape[0])
+    order_values = np.zeros(prices.shape[0])
+
+    # The sum of the placed orders is kept running, instead of summed again.
+    total_value = sum_orders(orders, has_order)
+
+    for index in price_order:
+        value = orders[index] if has_order[index] else 0.0
+        has_order[index] = False
+
+        # Calculate the price, quantity and the value of the order.
+        buy_quantity = value // prices[index]
+        order_value = buy_quantity * prices[index]
+
+        # Make transaction fee-efficient.
+        if order_value <= minimum_order_value:
+            buy_quantity = order_value = 0.0
+
+        total_value = distribute_remainder(
+            orders, has_order, value - order_value, total_value - value
+        )
 
-BVB_URL: str = "https://www.bvb.ro/FinancialInstruments/Indices/IndicesProfiles.aspx"
-BVB_XPATH: str = '//*[@id="gvC"]//tbody'
-
+        buy_quantities[index] = buy_quantity
+        order_values[index] = order_value
 
-TRADEVILLE_URL: str = "https://www.tradeville.eu/actiuni/actiuni-"
-TRADEVILLE_XPATH: str = '//div[@class="quotationTblLarge"]'
+    return buy_quantities, order_values
 
 
 class DashApplication(Dash):
@@ -54,6 +244,35 @@ class DashApplication(Dash):
         self.invest_amount = 0
         self.transaction_fee = 0
 
+        # The symbols are replaced by the collection in background while the
+        # callbacks read them. The callbacks hold the lock while they set, use
+        # and read the symbols, which take it too, so it is reentrant.
+        self.symbols_lock = threading.RLock()
+        # Increased on every replace of the symbols. The clients keep the
+        # generation of their table in a Store, so an older table is merged.
+        self.symbols_generation = 0
+        # Set when there are symbols, or when their first collection ended. The
+        # callbacks wait for it instead of starting the same collection.
+        self.symbols_collected = threading.Event()
+
+        # Compile the kernels now, so the first calculation does not wait for it.
+        for kernel in (eliminate_orders, place_orders):
+            kernel(
+                np.ones(1),
+                np.zeros(1),
+                np.zeros(1, bool),
+                np.zeros(1, np.intp),
+                MINIMUM_ORDER_VALUE,
+            )
+
+        # Start with the last collected symbols. Refresh them in background,
+        # so the application does not wait for the collection to start.
+        is_fresh = self.load_symbols_data()
+        if self.symbols_list:
+            self.symbols_collected.set()
+        if not is_fresh:
+            threading.Thread(target=self.refresh_symbols_data, daemon=True).start()
+
     def calculate_orders(self) -> None:
         """
         Calculate what quantity of each symbol to buy.
@@ -72,223 +291,167 @@ class DashApplication(Dash):
 
         This process is done in 2 iterations.
         """
-        # Work with net values.
-        invest_amount = self.invest_amount * (1 - self.transaction_fee)
-        print(f"Net invest_amount is {invest_amount}.", flush=True)
-
-        actual_portfolio = sum(
-            [
-                s.get("buy_price", 0) * s.get("current_quantity", 0)
-                for s in self.symbols_list
-            ]
+        # Work with net values. The fee is added back to the order values.
+        net_factor = 1 - self.transaction_fee
+        gross_factor = 1 + self.transaction_fee
+        invest_amount = self.invest_amount * net_factor
+        LOGGER.debug("Net invest_amount is %s.", invest_amount)
+
+        # Work with arrays (one for each column) instead of the dictionaries.
+        # The arrays are filled straight from the dictionaries, without lists.
+        # Read the list once, in case the collection replaces it meanwhile.
+        symbols_list = self.symbols_list
+        symbols = [s["symbol"] for s in symbols_list]
+        count = len(symbols_list)
+        prices = np.fromiter((s["buy_price"] for s in symbols_list), float, count)
+        weights = np.fromiter((s["weight"] for s in symbols_list), float, count)
+        quantities = np.fromiter(
+            (s["current_quantity"] for s in symbols_list), float, count
         )
-        print(f"The actual_portfolio is {actual_portfolio}.", flush=True)
+
+        actual_values = prices * quantities
+        actual_portfolio = float(actual_values.sum())
+        LOGGER.debug("The actual_portfolio is %s.", actual_portfolio)
 
         target_portfolio = actual_portfolio + invest_amount
-        print(f"The target_portfolio is {target_portfolio}.", flush=True)
+        LOGGER.debug("The target_portfolio is %s.", target_portfolio)
 
         # Adapt the weights, because not all the index symbols are included.
         # If 90% of the index is covered, multiplty each weight by (1/0.9).
-        scale_factor = 1 / sum([s.get("weight", 0) for s in self.symbols_list])
+        weights *= 1 / weights.sum()
+        for s, weight in zip(symbols_list, weights.tolist()):
+            s["weight"] = weight
 
         # First iteration. Check for differences. Add if they are positive.
-        orders: typing.Dict[str, float] = {}
-
-        for s in self.symbols_list:
-            # Update the weight. considering the new scale_factor.
-            s.update({"weight": s.get("weight", 0) * scale_factor})
-
-            actual = s.get("buy_price", 0) * s.get("current_quantity", 0)
-            target = target_portfolio * s.get("weight")
+        # Calculate first how much we need more of a symbol to reach the target.
+        differences = target_portfolio * weights - actual_values
+        positive = differences > 0
 
-            # Calculate first how much we need more of a symbol to reach the target.
-            difference = target - actual
-            if difference > 0:
-                orders[s.get("symbol")] = difference
-
-        print(f"Orders after initial: {orders}.", flush=True)
-
-        total_differences = sum(orders.values())
+        total_differences = float(differences[positive].sum())
         if total_differences < invest_amount:
             # Distribute what is left in an weighted manner.
-            total_differences = invest_amount - total_differences
-
-            for symbol in orders:
-                weight = next(
-                    s.get("weight", 0)
-                    for s in self.symbols_list
-                    if s.get("symbol") == symbol
-                )
-                orders[symbol] += total_differences * weight
+            differences += (invest_amount - total_differences) * weights
 
         else:
-            scale_factor = invest_amount / total_differences
-            for symbol in orders:
-                orders[symbol] *= scale_factor
-
-        # First, eliminate the orders that cannot be done because of fee.
-        symbols_heap = sorted(self.symbols_list, key=lambda s: s.get("weight"))
-        while True:
-            # Get the next symbol with the lowest weight.
-            print(orders, flush=True)
-            symbol = symbols_heap[0]
-
-            # Get its current allocated amount of money for purchase.
-            price = symbol.get("buy_price", 0)
-            value = orders.get(symbol.get("symbol"), 0)
+            differences *= invest_amount / total_differences
 
-            # Make transaction fee-efficient.
-            if (value // price) * price <= MINIMUM_ORDER_VALUE:
-                symbols_heap.pop(0)
-                orders.pop(symbol.get("symbol"), 0)
+        # The orders are kept in an array aligned with the symbols list. The mask
+        # holds the symbols that still have an order.
+        orders = np.where(positive, differences, 0.0)
+        has_order = positive
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            orders_placed = self.get_orders(symbols, orders, has_order)
+            LOGGER.debug("Orders after initial: %s.", orders_placed)
 
-                total_value = sum([value for value in orders.values()])
-                for key in orders.keys():
-                    orders[key] += value * (orders[key] / total_value)
-            else:
-                break
+        # First, eliminate the orders that cannot be done because of fee.
+        # The weights were scaled in place, so they give the same order.
+        eliminate_orders(
+            prices,
+            orders,
+            has_order,
+            np.argsort(weights, kind="stable"),
+            MINIMUM_ORDER_VALUE,
+        )
 
-        print(f"Orders after eliminating the impossible ones: {orders}.", flush=True)
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            orders_placed = self.get_orders(symbols, orders, has_order)
+            LOGGER.debug(
+                "Orders after eliminating the impossible ones: %s.", orders_placed
+            )
 
         # Calculate the exact values of the buying orders.
-        # Sort the list by price, to use the remainders from each purchase.
-        symbols_heap = sorted(
-            self.symbols_list, key=lambda s: s.get("buy_price"), reverse=True
+        # Go by price, descending, to use the remainders from each purchase.
+        buy_quantities, order_values = place_orders(
+            prices,
+            orders,
+            has_order,
+            np.argsort(-prices, kind="stable"),
+            MINIMUM_ORDER_VALUE,
         )
 
-        while symbols_heap:
-            # Get the next symbol with the biggest price.
-            symbol = symbols_heap.pop(0)
-
-            # Get its current allocated amount of money for purchase.
-            price = symbol.get("buy_price", 0)
-            value = orders.pop(symbol.get("symbol"), 0)
-
-            # Calculate the price, quantity and the value of the order.
-            order = {
-                "buy_quantity": value // price,
-                "order_value": (value // price) * price,
-            }
-
-            # Make transaction fee-efficient.
-            if order.get("order_value") <= MINIMUM_ORDER_VALUE:
-                order = {"buy_quantity": 0, "order_value": 0}
+        # Update the columns in the table, adding the tax in the order value.
+        for symbol, buy_quantity, order_value in zip(
+            symbols_list, buy_quantities.tolist(), order_values.tolist()
+        ):
+            symbol["buy_quantity"] = buy_quantity
+            symbol["order_value"] = round(order_value * gross_factor, 2)
 
-            # Calculate the value of remaining money after executing the
-            # order for the current symbol. Distribute the rest to the others.
-            value -= order.get("order_value")
+        # Every symbol has its name, so sort the list in place by it.
+        symbols_list.sort(key=operator.itemgetter("symbol"))
 
-            # Distribute the remainder from this purchase.
-            total_value = sum([value for value in orders.values()])
-            for key in orders.keys():
-                orders[key] += value * (orders[key] / total_value)
-
-            # Add the tax in the order value.
-            order["order_value"] = round(
-                order["order_value"] * (1 + self.transaction_fee), 2
+    @staticmethod
+    def get_orders(
+        symbols: typing.List[str], orders: np.ndarray, has_order: np.ndarray
+    ) -> typing.Dict[str, float]:
+        """
+        Get the orders that are still placed, by symbol, to be logged.
+        """
+        return {
+            symbol: order
+            for symbol, order, is_placed in zip(
+                symbols, orders.tolist(), has_order.tolist()
             )
+            if is_placed
+        }
 
-            # Update the columns in the table.
-            for item in self.symbols_list:
-                if item["symbol"] == symbol["symbol"]:
-                    item.update(order)
-                    break
-
-        self.symbols_list = sorted(self.symbols_list, key=lambda s: s.get("symbol"))
-
-    def collect_symbols_data(self, symbols_list_size: int = SYMBOLS_LIST_SIZE) -> None:
+    def collect_symbols_data(
+        self,
+        symbols_list_size: int = SYMBOLS_LIST_SIZE,
+        max_age: int = collector.CACHE_MAX_AGE,
+    ) -> None:
         """
-        Get the details of the *specified* first elements of the BET Index.
-        Use the websites of the Bucharest Stock Exchange and Tradeville.
-
-        The first element of the list will be the time of the operation.
-
-        There are two steps. The result consists of a list of dictionaries.
-        The keys are represented by the union of the following:
-        1) Get the list of symbols with some information from BVB.
-            0. symbol
-            1. company
-            2. shares
-            3. price
-            4. free_float_factor
-            5. representation_factor
-            6. price_correction_factor
-            7. weight
-
-        2) Get more details about every symbol from Tradeville website.
-            1.  last_price
-            3.  variation
-            5.  open_price
-            7.  max/min_price
-            9.  medium_price
-            11. volume
-            13. dividend_yield
-
-        The number before each key is the index of it in the raw data.
+        Get the details of the *specified* first elements of the BET Index,
+        using the Collector. Pages fetched in the last max_age seconds are
+        read from its cache.
+
+        The result is also saved on disk, to be loaded by load_symbols_data.
         """
-        self.symbols_list: typing.List[typing.Dict] = []
+        symbols_list = collector.collect_symbols_data(symbols_list_size, max_age)
 
-        # Get the list of symbols from the Bucharest Stock Exchange website.
-        bvb_document = self.get_html_document(url=BVB_URL)
+        symbols_time = datetime.datetime.now(TIMEZONE).strftime(TIME_FORMAT)
 
-        # Extract the data of each cell (HTML TD) from each row (HTML TR).
-        # Get the table with the symbols. Xpath returns a tbody, so parse it.
-        for bvb_row in bvb_document.xpath(BVB_XPATH)[0][:symbols_list_size]:
-            bvb_row = [data.text_content().strip() for data in bvb_row]
+        # Replace the file at once, so it is never read partially written. The
+        # temporary file is unique, as the callbacks and the refresh can collect
+        # at the same time.
+        os.makedirs(collector.CACHE_DIRECTORY, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=collector.CACHE_DIRECTORY, suffix=".tmp", delete=False
+        ) as symbols_file:
+            pickle.dump((symbols_time, symbols_list), symbols_file)
+        os.replace(symbols_file.name, SYMBOLS_FILE_NAME)
 
-            # Get the more information from Tradeville using the symbol name.
-            tradeville_document = self.get_html_document(
-                url=TRADEVILLE_URL + bvb_row[0]
-            )
+        self.replace_symbols_data(symbols_time, symbols_list)
 
-            for trv_row in tradeville_document.xpath(TRADEVILLE_XPATH):
-                trv_row = [data.text_content().strip() for data in trv_row]
-
-                # Some yields are 'n/a'.
-                try:
-                    dividend_yield = float(trv_row[13].replace("%", ""))
-                except Exception:
-                    dividend_yield = 0
-
-                # Build the list of symbols.
-                self.symbols_list.append(
-                    {
-                        "symbol": bvb_row[0],
-                        "weight": float(bvb_row[7]) / 100.0,
-                        "open_price": float(trv_row[5]),
-                        "buy_price": float(trv_row[1]),
-                        "variation": float(trv_row[3].replace("%", "")),
-                        "medium_price": float(trv_row[9]),
-                        "min_price": float(trv_row[7].split("/")[1]),
-                        "max_price": float(trv_row[7].split("/")[0]),
-                        "dividend_yield": dividend_yield,
-                        "volume": int(trv_row[11].replace(",", "")),
-                        "shares": int(bvb_row[2].replace(",", "")),
-                        "company": bvb_row[1],
-                        "free_float_factor": float(bvb_row[4]),
-                        "representation_factor": float(bvb_row[5]),
-                        "price_correction_factor": float(bvb_row[6]),
-                    }
-                )
-
-                # Select only the first column from the Tradeville info table.
-                break
-
-        self.symbols_time = str(
-            datetime.datetime.now(pytz.timezone("Europe/Bucharest"))
-        ).split(".")[0]
-
-    def get_html_document(self, url: str) -> HtmlElement:
+    def refresh_symbols_data(self) -> None:
         """
-        Get the HTML document of a web page and parse it using lxml module.
-
-        If the response failed, an Exception will be raised.
-        Further, the information will be extracted using xpath.
+        Collect the symbols in background. A failure is only logged, as the
+        callbacks collect the symbols themselves if there are none.
         """
-        response = requests.get(url)
-        response.raise_for_status()
+        try:
+            self.collect_symbols_data()
+        except Exception:
+            LOGGER.exception("Failed to refresh the symbols data.")
+        finally:
+            self.symbols_collected.set()
+
+    def load_symbols_data(self, max_age: int = collector.CACHE_MAX_AGE) -> bool:
+        """
+        Load the symbols saved by the last collection, if there is one.
 
-        return fromstring(response.content)
+        Return True if they were collected in the last max_age seconds.
+        """
+        try:
+            with open(SYMBOLS_FILE_NAME, "rb") as symbols_file:
+                symbols_time, symbols_list = pickle.load(symbols_file)
+                # Read the time of the open file, as it can be replaced meanwhile.
+                symbols_mtime = os.fstat(symbols_file.fileno()).st_mtime
+        except Exception:
+            # There is no saved file, or it cannot be read (truncated, or saved
+            # by another version). The symbols are collected again.
+            return False
+
+        self.replace_symbols_data(symbols_time, symbols_list)
+        return time.time() - symbols_mtime < max_age
 
     def html_init_layout(self) -> None:
         """
@@ -306,6 +469,7 @@ class DashApplication(Dash):
                 Div(self.html_instruction_list(), style=DIV_STYLE),
                 Div(self.html_financials_inputs(), style=DIV_STYLE),
                 Div(self.html_symbols_datatable(), style=DIV_STYLE),
+                Store(id="symbols_generation"),
             ]
         )
 
@@ -398,44 +562,7 @@ class DashApplication(Dash):
     def html_symbols_datatable(self) -> DataTable:
         return DataTable(
             id="symbols_datatable",
-            columns=[
-                {
-                    "id": "symbol",
-                    "name": "Symbol",
-                    "editable": False,
-                    "type": "text",
-                },
-                self.html_number_datatable_cell(
-                    id="current_quantity",
-                    name="Current Quantity",
-                    editable=True,
-                ),
-                self.html_number_datatable_cell(
-                    id="variation",
-                    name="Price Variation (%)",
-                    precision=4,
-                ),
-                self.html_number_datatable_cell(
-                    id="medium_price",
-                    name="Medium Price (RON)",
-                    precision=4,
-                ),
-                self.html_number_datatable_cell(
-                    id="buy_price",
-                    name="Buy Price (RON)",
-                    editable=True,
-                    precision=4,
-                ),
-                self.html_number_datatable_cell(
-                    id="buy_quantity",
-                    name="Buy Quantity",
-                ),
-                self.html_number_datatable_cell(
-                    id="order_value",
-                    name="Order Value (RON)",
-                    precision=2,
-                ),
-            ],
+            columns=SYMBOLS_DATATABLE_COLUMNS,
             editable=True,
             style_cell={"min-width": "150px"},
             style_data_conditional=[
@@ -459,27 +586,6 @@ class DashApplication(Dash):
             ],
         )
 
-    def html_number_datatable_cell(
-        self,
-        id: str,
-        name: str,
-        editable: bool = False,
-        precision: int = 0,
-        default: int = 0,
-    ) -> typing.Dict[str, typing.Any]:
-        """
-        Create a Dash DataTable cell with type number.
-        """
-        return {
-            "editable": editable,
-            "id": id,
-            "format": Format(precision=precision, scheme=Scheme.fixed),
-            "name": name,
-            "on_change": {"failure": "default"},
-            "validation": {"default": default},
-            "type": "numeric",
-        }
-
     def get_symbols_time(self) -> str:
         if not self.symbols_time:
             return ""
@@ -489,8 +595,46 @@ class DashApplication(Dash):
     def get_symbols_list(self) -> typing.List[typing.Dict]:
         return self.symbols_list if self.symbols_list else []
 
-    def set_symbols_list(self, symbols_list: typing.List[typing.Dict]) -> None:
-        self.symbols_list = symbols_list
+    def get_symbols_generation(self) -> int:
+        return self.symbols_generation
+
+    def set_symbols_list(
+        self, symbols_list: typing.List[typing.Dict], generation: typing.Optional[int]
+    ) -> None:
+        with self.symbols_lock:
+            if generation != self.symbols_generation:
+                # The table of the client was built before the symbols were
+                # replaced. Keep the new symbols, only with its quantities.
+                quantities = {
+                    s["symbol"]: s.get("current_quantity", 0) for s in symbols_list
+                }
+                for symbol in self.symbols_list:
+                    symbol["current_quantity"] = quantities.get(symbol["symbol"], 0)
+                return
+
+            # Add the missing quantities here, once, so the calculation reads
+            # every column without defaults.
+            for symbol in symbols_list:
+                symbol.setdefault("current_quantity", 0)
+
+            self.symbols_list = symbols_list
+
+    def replace_symbols_data(
+        self, symbols_time: str, symbols_list: typing.List[typing.Dict]
+    ) -> None:
+        """
+        Replace the symbols and their time with the collected ones, at once.
+        The tables that the clients got before give only the quantities.
+        """
+        with self.symbols_lock:
+            self.symbols_generation += 1
+
+            # The collected symbols have no quantity yet.
+            for symbol in symbols_list:
+                symbol.setdefault("current_quantity", 0)
+
+            self.symbols_time = symbols_time
+            self.symbols_list = symbols_list
 
     def set_invest_amount(self, invest_amount: float) -> None:
         self.invest_amount = invest_amount
@@ -1,16 +1,36 @@
 #!/usr/bin/env python3
 
 
+from asyncio import (
+    IncompleteReadError, Runner, StreamReader, StreamWriter, get_running_loop,
+    start_server
+)
 from concurrent.futures import ThreadPoolExecutor
-from json import dumps, loads
+from functools import lru_cache
 from math import floor
 from multiprocessing import cpu_count
-from socket import AF_INET, SOCK_STREAM, socket
-from time import sleep
+from struct import Struct
+from threading import Lock
+from time import monotonic, sleep
 from traceback import print_exc
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
-from mysql.connector import connect
+import numpy as np
+from mysql.connector.pooling import (
+    CNX_POOL_MAXSIZE, MySQLConnectionPool, PooledMySQLConnection
+)
+
+try:
+    from uvloop import new_event_loop
+except ImportError:
+    from asyncio import new_event_loop
+
+try:
+    from numba import njit
+except ImportError:
+    # Without Numba, the kernels run as plain Python functions.
+    def njit(*args, **kwargs):
+        return lambda function: function
 
 # Constants used in program, especially in dictionaries.
 PRICE = 'price'
@@ -18,16 +38,125 @@ SYMBOL = 'symbol'
 WEIGHT = 'weight'
 QUANTITY = 'quantity'
 
+# Size of the length prefix of every message sent through the sockets.
+HEADER_SIZE = 4
+
+# The binary layout of the messages. The visualizer sends the general row
+# (invest amount and transaction fee), followed by the rows of the symbols
+# table (symbol, price, current quantity, buy quantity and order value).
+# The server answers only with the rows of the symbols table.
+GENERAL_ROW = Struct('!dd')
+SYMBOLS_ROW = Struct('!8sdddd')
+
+# An order must be bigger than the minimum commission divided by the fee,
+# or than a fixed value when there is no fee.
+MINIMUM_COMMISSION = 1.9
+MINIMUM_ORDER_WITHOUT_FEE = 268.0
+
+
+@lru_cache(maxsize=32)
+def get_fee_factors(fee: float) -> Tuple[float, float, float]:
+    """
+        The values derived from a transaction fee, which changes rarely:
+        the net factor of the invest amount, the gross factor of the orders
+        and the minimum value of an order.
+    """
+    if fee:
+        minimum_order = MINIMUM_COMMISSION / fee
+    else:
+        minimum_order = MINIMUM_ORDER_WITHOUT_FEE
+
+    return 1 - fee, 1 + fee, minimum_order
+
+
+@njit(cache=True)
+def allocate_amounts(
+    prices, quantities, weights, price_order, invest_amount, minimum
+):
+    """
+        The arithmetic core of Application.calculate_symbols_amounts, working
+        only with arrays aligned with the symbols. The price_order contains
+        the indices of the symbols, sorted descending by price.
+
+        Return the buy quantities and the values of the orders (without the
+        transaction fee).
+    """
+    count = prices.shape[0]
+
+    # Calculate the actual and the target value of portfolio.
+    actual_values = prices * quantities
+    target_portfolio = actual_values.sum() + invest_amount
+
+    # Adapt the weights of the symbols because we work only with a part.
+    # Let's say we cover 90% of the index. So mutiply with 1.1f.
+    scale_factor = 2 - weights.sum()
+
+    # The first iteration. Check for difference of target and actual.
+    orders = np.maximum(
+        target_portfolio * scale_factor * weights - actual_values, 0.0
+    )
+    has_order = orders > 0
+
+    # Make the sum of all the differences.
+    diffs_sum = orders.sum()
+
+    if diffs_sum < invest_amount:
+        diffs_sum = invest_amount - diffs_sum
+
+        # Spread the difference to all the symbols, but weighted.
+        for index in range(count):
+            if has_order[index]:
+                orders[index] += diffs_sum * scale_factor * weights[index]
+
+    elif diffs_sum > 0:
+        # Scale every difference according with the weights and budget.
+        orders *= invest_amount / diffs_sum
+
+    buy_quantities = np.zeros(count, np.int64)
+    order_values = np.zeros(count)
+
+    # The remaining money is distributed lazily: pending is the amount
+    # added to every order that was not executed yet.
+    pending = 0.0
+    remaining = has_order.sum()
+
+    # Go by price, descending, to use the remainders from each purchase.
+    for index in price_order:
+        if not has_order[index]:
+            continue
+
+        invest_amount = orders[index] + pending
+        remaining -= 1
+
+        # Calculate the quantity and the value of the order.
+        buy_quantity = floor(invest_amount / prices[index])
+        order_value = buy_quantity * prices[index]
+
+        if order_value <= minimum:
+            buy_quantity = 0
+            order_value = 0.0
+
+        # Distribute the rest of the money to the remaining orders.
+        if remaining:
+            pending += (invest_amount - order_value) / remaining
+
+        buy_quantities[index] = buy_quantity
+        order_values[index] = order_value
+
+    return buy_quantities, order_values
+
 
 class Application:
     """
-        This class represents a multi-threading server that will accept
+        This class represents an asynchronous server that will accept
         connections from visualizers and will calculate the amount of money for
         every symbol, using also informations from the MySQL database.
     """
 
     MYSQL_CONFIG = {
         'symbols_limit': 10,
+        # The collector updates the symbols every 60 seconds.
+        'symbols_max_age': 55,
         'retries': 30,
         'timeout': 1,
         'connect':  {
@@ -52,27 +181,49 @@ class Application:
 
         self.executor = ThreadPoolExecutor(max_workers=self.backlog)
 
+        # The MySQL connections are reused by the executor, through a pool.
+        # It is created on the first request, when the database is ready.
+        self.pool = None
+        self.pool_lock = Lock()
+
+        # The symbols are shared by all the connections, for a while.
+        self.symbols_cache = (0.0, None)
+        self.symbols_lock = Lock()
+
+        # Compile the allocation kernel now, not on the first request.
+        allocate_amounts(
+            np.ones(1),
+            np.zeros(1),
+            np.ones(1),
+            np.zeros(1, np.int64),
+            1.0,
+            0.0,
+        )
+
     def run(self) -> None:
         """
-            Create a socket to communicate with the visualizers.
-            For every connection, execute the thread_target in an other thread.
+            Run the server in an event loop, with uvloop if it is installed.
         """
-        self.socket = socket(AF_INET, SOCK_STREAM)
-        self.socket.bind((self.host, self.port))
-        self.socket.listen(self.backlog)
+        with Runner(loop_factory=new_event_loop) as runner:
+            runner.run(self.serve())
 
-        while True:
-            try:
-                client, address = self.socket.accept()
-                self.executor.submit(self.thread_target, client, address)
+    async def serve(self) -> None:
+        """
+            Create a server to communicate with the visualizers.
+            Every connection is handled by handle_client, in the same loop.
+        """
+        server = await start_server(
+            self.handle_client, self.host, self.port, backlog=self.backlog
+        )
 
-            except Exception:
-                self.executor.shutdown()
-                print_exc()
+        async with server:
+            await server.serve_forever()
 
-    def thread_target(self, client, address) -> None:
+    async def handle_client(
+        self, reader: StreamReader, writer: StreamWriter
+    ) -> None:
         """
-            The workflow of a thread consists of:
+            The workflow of a connection consists of:
 
             1) Get from the database an initial data about the index of format:
                {'symbol': {'price': <float_price>, 'weight': <float_weight>}}.
@@ -85,14 +236,25 @@ class Application:
             the general_table and the symbols_table, calculate the amount of
             money to every symbol (so the data of the symbols_table) and send
             it back to the visualizer.
+
+            The database is queried in the executor, to not block the loop.
         """
         try:
-            symbols = self.get_db_symbols()
+            symbols = await get_running_loop().run_in_executor(
+                self.executor, self.get_cached_db_symbols
+            )
             symbols = {symbol: symbols[symbol] for symbol in sorted(symbols)}
 
-            symbols_weights = {
-                symbol: item['weight'] for symbol, item in symbols.items()
-            }
+            # The symbols table keeps this order, so the weights are aligned
+            # with its rows for the whole connection.
+            symbols_weights = np.array(
+                [item['weight'] for item in symbols.values()], float
+            )
+
+            # The prices come from the database, so sort them only once.
+            price_order = np.argsort(
+                [-item['price'] for item in symbols.values()], kind='stable'
+            )
 
             symbols_init = [
                 {
@@ -105,33 +267,111 @@ class Application:
                 for symbol, item in symbols.items()
             ]
 
-            client.sendall(dumps(symbols_init).encode('utf-8'))
+            await self.send_message(
+                writer, self.pack_symbols_table(symbols_init)
+            )
 
             while True:
-                general_table = loads(client.recv(1024).decode('utf-8'))
-                symbols_table = loads(client.recv(1024).decode('utf-8'))
+                message = await self.receive_message(reader)
 
-                invest_amount = float(general_table[0]['invest-amount'])
-                fee = float(general_table[0]['transaction-fee']) / 100.0
+                invest_amount, fee = GENERAL_ROW.unpack_from(message)
+                fee = fee / 100.0
 
+                symbols_table = self.unpack_symbols_table(
+                    memoryview(message)[GENERAL_ROW.size:]
+                )
+
+                # The compiled kernel is fast enough to run in the loop.
                 self.calculate_symbols_amounts(
-                    invest_amount, fee, symbols_table, symbols_weights
+                    invest_amount,
+                    fee,
+                    symbols_table,
+                    symbols_weights,
+                    price_order,
+                )
+
+                await self.send_message(
+                    writer, self.pack_symbols_table(symbols_table)
                 )
 
-                client.sendall(dumps(symbols_table).encode('utf-8'))
+        except IncompleteReadError:
+            # The visualizer closed the connection.
+            writer.close()
 
         except Exception:
-            client.close()
+            writer.close()
             print_exc()
 
+    @staticmethod
+    async def send_message(writer: StreamWriter, payload: bytes) -> None:
+        """
+            Send the payload prefixed by its length (4 bytes, big endian), so
+            the other side knows where the message ends in the TCP stream.
+        """
+        writer.write(len(payload).to_bytes(HEADER_SIZE, 'big') + payload)
+        await writer.drain()
+
+    @staticmethod
+    async def receive_message(reader: StreamReader) -> bytes:
+        """
+            Receive a message sent with send_message (length prefixed).
+        """
+        header = await reader.readexactly(HEADER_SIZE)
+        return await reader.readexactly(int.from_bytes(header, 'big'))
+
+    @staticmethod
+    def pack_symbols_table(symbols_table: List[Dict]) -> bytearray:
+        """
+            Pack the rows of the symbols table, one after the other.
+        """
+        payload = bytearray(len(symbols_table) * SYMBOLS_ROW.size)
+
+        for index, row in enumerate(symbols_table):
+            SYMBOLS_ROW.pack_into(
+                payload,
+                index * SYMBOLS_ROW.size,
+                row['symbol'].encode('ascii'),
+                row['price'],
+                row['current-quantity'],
+                row['buy-quantity'],
+                row['order-value'],
+            )
+
+        return payload
+
+    @staticmethod
+    def unpack_symbols_table(payload: bytes) -> List[Dict]:
+        """
+            Unpack the rows of the symbols table sent by the visualizer.
+        """
+        return [
+            {
+                'symbol': symbol.rstrip(b'\0').decode('ascii'),
+                'price': price,
+                'current-quantity': current_quantity,
+                'buy-quantity': buy_quantity,
+                'order-value': order_value,
+            }
+            for symbol, price, current_quantity, buy_quantity, order_value
+            in SYMBOLS_ROW.iter_unpack(payload)
+        ]
+
     def calculate_symbols_amounts(
-        self, invest_amount: float, fee: float, symbols: List, weights: Dict
+        self,
+        invest_amount: float,
+        fee: float,
+        symbols: List,
+        weights: np.ndarray,
+        price_order: Optional[np.ndarray] = None,
     ) -> List:
         """
             This function will make the calculus for every symbol.
 
             The symbols parameter contains a list with the details about each
-            symbol in a dictionary, sorted by the symbols names.
+            symbol in a dictionary, sorted by the symbols names. The weights
+            parameter is an array with the weight of each of these symbols.
+            The price_order, if known, contains the indices of the symbols
+            sorted descending by price. It is checked against the prices.
 
             The idea is to calculate for a symbol:
             1) What is the current value in portfolio.
@@ -144,89 +384,56 @@ class Application:
                 * is smaller than the invest_amount, distribute the difference
                 between to the amount of each symbol, according to the weights.
         """
-        # Work with net value of the invest amount.
-        invest_amount = invest_amount * (1 - fee)
+        net_factor, gross_factor, minimum_order = get_fee_factors(fee)
 
-        # Calculate the actual and the target value of portfolio.
-        actual_portfolio = sum([
-            item['price'] * item['current-quantity'] for item in symbols
-        ])
-        target_portfolio = actual_portfolio + invest_amount
-
-        # Adapt the weights of the symbols because we work only with a part.
-        # Let's say we cover 90% of the index. So mutiply with 1.1f.
-        scale_factor = 2 - sum([weights[item['symbol']] for item in symbols])
-
-        # The first iteration. Check for difference of target and actual.
-        orders = {}
-
-        for symbol, price, quant, _, _ in [list(it.values()) for it in symbols]:
-            actual = quant * price
-            target = target_portfolio * scale_factor * weights[symbol]
-
-            difference = target - actual
-            if difference > 0:
-                orders[symbol] = difference
-
-        # Make the sum of all the differences.
-        diffs_sum = sum(orders.values())
-
-        if diffs_sum < invest_amount:
-            diffs_sum = invest_amount - diffs_sum
-
-            # Spread the difference to all the symbols, but weighted.
-            for symbol, order in orders.items():
-                orders[symbol] += diffs_sum * scale_factor * weights[symbol]
-
-        elif diffs_sum > 0:
-            # Scale every difference according with the weights and budget.
-            scale_factor = invest_amount / diffs_sum
-
-            for symbol, order in orders.items():
-                orders[symbol] = orders[symbol] * scale_factor
-
-        # Calculate the exact values of the buying orders.
-        # Make sure that is bigger than the minimum sum.
-        if fee:
-            minimum_order = 1.9 / fee
-        else:
-            minimum_order = 268
+        # Work with net value of the invest amount.
+        invest_amount = invest_amount * net_factor
 
-        # Sort the list by price, to use the remainders from each purchase.
-        desc_price_symbols = sorted(
-            symbols, key=lambda item: item['price'], reverse=True
+        # Work with arrays (one for each column), aligned with the symbols.
+        prices = np.array([item['price'] for item in symbols], float)
+        quantities = np.array(
+            [item['current-quantity'] for item in symbols], float
         )
 
-        while desc_price_symbols:
-            symbol, price, current_quantity, _, _ = list(
-                desc_price_symbols.pop(0).values()
-            )
-
-            invest_amount = orders.pop(symbol, 0)
-
-            # Calculate the price, quantity and the value of the order.
-            buy_quantity = floor(invest_amount / price)
-            order_value = buy_quantity * price
+        # Sort the symbols by price, only if the order is not known yet or
+        # the prices were edited. A strictly descending order is unique.
+        if price_order is None or (np.diff(prices[price_order]) >= 0).any():
+            price_order = np.argsort(-prices, kind='stable')
+
+        buy_quantities, order_values = allocate_amounts(
+            prices,
+            quantities,
+            weights,
+            price_order,
+            invest_amount,
+            minimum_order,
+        )
 
-            if order_value <= minimum_order:
-                buy_quantity = 0
-                order_value = 0
+        for item, buy_quantity, order_value in zip(
+            symbols, buy_quantities.tolist(), order_values.tolist()
+        ):
+            item['buy-quantity'] = buy_quantity
+            item['order-value'] = round(order_value * gross_factor, 2)
 
-            # Calculate the value of remaining money after executing the
-            # order for the current symbol. Distribute the rest to the others.
-            invest_amount -= order_value
+        return symbols
 
-            # Distribute the remaining money to the rest of symbols.
-            for key in orders:
-                orders[key] += invest_amount / len(orders)
+    def get_cached_db_symbols(self) -> Dict:
+        """
+            Get the symbols from database only if the cached ones are older
+            than the symbols_max_age. When more visualizers connect at the
+            same time, only one of them will execute the query.
+        """
+        with self.symbols_lock:
+            timestamp, symbols = self.symbols_cache
+            now = monotonic()
 
-            for item in symbols:
-                if item['symbol'] == symbol:
-                    item['buy-quantity'] = buy_quantity
-                    item['order-value'] = round(order_value * (1 + fee), 2)
-                    break
+            if symbols is None or (
+                now - timestamp > Application.MYSQL_CONFIG['symbols_max_age']
+            ):
+                symbols = self.get_db_symbols()
+                self.symbols_cache = (now, symbols)
 
-        return symbols
+            return symbols
 
     def get_db_symbols(self) -> Dict:
         """
@@ -238,13 +445,50 @@ class Application:
             The ouput is a dictionary:
                 {'symbol': {'price': <float_price>, 'weight': <float_weight>}}.
         """
-        symbols = {}
+        connection = self.get_db_connection()
+
+        try:
+            # Get the cursor for this MySQL connection.
+            cursor = connection.cursor()
+            if not cursor:
+                return {}
+
+            # Execute the query and read all the rows at once.
+            cursor.execute(
+                Application.MYSQL_CONFIG['query'],
+                (Application.MYSQL_CONFIG['symbols_limit'], )
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+
+        finally:
+            # Closing a pooled connection returns it to the pool.
+            connection.close()
+
+        # Put the results in the desired form in a dictionary.
+        return {
+            row[0]: {PRICE: float(row[1]), WEIGHT: float(row[2]) / 100.0}
+            for row in rows
+        }
+
+    def get_db_connection(self) -> PooledMySQLConnection:
+        """
+            Get a connection from the pool, creating the pool if needed.
+            Wait if the MySQL database is not ready.
+        """
         connection = None
 
-        # Try to get a connection and wait if the MySQL database is not ready.
         for index in range(Application.MYSQL_CONFIG['retries']):
             try:
-                connection = connect(**Application.MYSQL_CONFIG['connect'])
+                with self.pool_lock:
+                    if self.pool is None:
+                        self.pool = MySQLConnectionPool(
+                            pool_name='application',
+                            pool_size=min(self.backlog, CNX_POOL_MAXSIZE),
+                            **Application.MYSQL_CONFIG['connect']
+                        )
+
+                connection = self.pool.get_connection()
                 if connection and connection.is_connected():
                     break
 
@@ -254,27 +498,7 @@ class Application:
                 else:
                     sleep(Application.MYSQL_CONFIG['timeout'])
 
-        # Get the cursor for this MySQL connection.
-        cursor = connection.cursor()
-        if not cursor:
-            connection.close()
-            return symbols
-
-        # Execute the query.
-        cursor.execute(
-            Application.MYSQL_CONFIG['query'],
-            (Application.MYSQL_CONFIG['symbols_limit'], )
-        )
-
-        # Put the results in the desired form in a dictionary.
-        for var in cursor:
-            symbols.update({
-                var[0]:  {PRICE: float(var[1]), WEIGHT: float(var[2]) / 100.0}
-            })
-
-        cursor.close()
-        connection.close()
-        return symbols
+        return connection
 
 
 if __name__ == '__main__':
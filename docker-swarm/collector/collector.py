@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
 
 
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 from sys import exit
 from time import sleep
 from typing import Dict, List
 
-from lxml.html import HtmlElement, fromstring
-from requests import get
+from lxml.etree import XPath
+from lxml.html import HtmlElement, HTMLParser
+from requests import Session
+from requests.adapters import HTTPAdapter
 
-from mysql.connector import connect
+from mysql.connector import MySQLConnection, connect
 
 LOOP_INTERVAL = 1 * 60
 
@@ -21,6 +25,15 @@ MYSQL_CONFIG = {
     'host': 'mysql',
 }
 
+# Build the row of the symbols table from a symbol dictionary, by keys, in
+# the order of the columns of the query.
+SYMBOLS_TABLE_ROW = itemgetter(
+    'symbol', 'weight', 'open_price', 'buy_price', 'variation',
+    'medium_price', 'min_price', 'max_price', 'dividend_yield', 'volume',
+    'shares', 'company', 'free_float_factor', 'representation_factor',
+    'price_correction_factor',
+)
+
 
 SYMBOLS_LIST_SIZE = 17
 
@@ -28,11 +41,48 @@ SYMBOLS_LIST_SIZE = 17
 BVB_URL: str = (
     'https://www.bvb.ro/FinancialInstruments/Indices/IndicesProfiles.aspx'
 )
-BVB_XPATH: str = '//*[@id="gvC"]//tbody'
+# The XPath expressions are compiled once, at import. The rows of the first
+# table body are limited by the size variable, when evaluated.
+BVB_XPATH: XPath = XPath(
+    '(//*[@id="gvC"]//tbody)[1]/*[position() <= $size]'
+)
 
 
 TRADEVILLE_URL: str = 'https://www.tradeville.eu/actiuni/actiuni-'
-TRADEVILLE_XPATH: str = '//div[@class="quotationTblLarge"]'
+# Only the first table of the class is read, so the XPath stops at it.
+TRADEVILLE_XPATH: XPath = XPath('(//div[@class="quotationTblLarge"])[1]')
+
+# Used to remove the percent signs and the thousands separators from numbers.
+NUMBER_SYMBOLS: Dict[int, None] = str.maketrans('', '', '%,')
+
+
+REQUEST_TIMEOUT = 30
+CHUNK_SIZE = 64 * 1024
+
+# The maximum number of Tradeville pages requested at the same time.
+MAX_WORKERS = 8
+
+# Only a few tables are read from each page, so skip the ids, comments and
+# processing instructions. A feed parser keeps the state of its document, so
+# every page gets its own parser, built with these options.
+HTML_PARSER_OPTIONS = {
+    'collect_ids': False,
+    'remove_comments': True,
+    'remove_pis': True,
+}
+
+# Reuse the connections (keep-alive) to BVB and Tradeville between requests.
+SESSION = Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+SESSION.headers.update({'Accept-Encoding': 'br, gzip, deflate'})
+
+
+def to_float(text: str) -> float:
+    return float(text.translate(NUMBER_SYMBOLS))
+
+
+def to_int(text: str) -> int:
+    return int(text.translate(NUMBER_SYMBOLS))
 
 
 class Collector:
@@ -43,6 +93,9 @@ class Collector:
             1 - get the symbols of the index and their weights from BVB.
             2 - get more details about every symbol from Tradeville broker.
         """
+        # The MySQL connection is kept open between the iterations.
+        connection = None
+
         while True:
             symbols_list = []
 
@@ -58,7 +111,16 @@ class Collector:
 
             # Insert or update the symbols into the MySQL database.
             try:
-                Collector.update_mysql_symbols_table(symbols_list)
+                if connection is None:
+                    connection = Collector.get_mysql_connection()
+                else:
+                    connection.ping(
+                        reconnect=True,
+                        attempts=MYSQL_RETRIES,
+                        delay=MYSQL_TIMEOUT,
+                    )
+
+                Collector.update_mysql_symbols_table(connection, symbols_list)
 
             except Exception as exception:
                 exit(
@@ -107,45 +169,68 @@ class Collector:
         bvb_document = Collector.get_html_document(url=BVB_URL)
 
         # Extract the data of each cell (HTML TD) from each row (HTML TR).
-        # Get the table with the symbols. Xpath returns a tbody, so parse it.
-        for bvb_row in bvb_document.xpath(BVB_XPATH)[0][:symbols_list_size]:
-            bvb_row = [data.text_content().strip() for data in bvb_row]
-
-            # Get the more information from Tradeville using the symbol name.
-            tradeville_document = Collector.get_html_document(
-                url=TRADEVILLE_URL + bvb_row[0]
+        # Get the table with the symbols. Xpath returns the first rows of it.
+        bvb_rows = [
+            [data.text_content().strip() for data in bvb_row]
+            for bvb_row in BVB_XPATH(bvb_document, size=symbols_list_size)
+        ]
+
+        # Get the more information from Tradeville using the symbol name.
+        # The pages are requested at the same time, in different threads.
+        with ThreadPoolExecutor(MAX_WORKERS) as executor:
+            tradeville_documents = executor.map(
+                Collector.get_html_document,
+                [TRADEVILLE_URL + bvb_row[0] for bvb_row in bvb_rows],
             )
 
-            for trv_row in tradeville_document.xpath(TRADEVILLE_XPATH):
-                trv_row = [data.text_content().strip() for data in trv_row]
-
-                # Some yields are 'n/a'.
-                try:
-                    dividend_yield = float(trv_row[13].replace('%', ''))
-                except Exception:
-                    dividend_yield = 0
-
-                # Build the list of symbols.
-                symbols_list.append({
-                    'symbol': bvb_row[0],
-                    'weight': float(bvb_row[7]) / 100.0,
-                    'open_price': float(trv_row[5]),
-                    'buy_price': float(trv_row[1]),
-                    'variation': float(trv_row[3].replace('%', '')),
-                    'medium_price': float(trv_row[9]),
-                    'min_price': float(trv_row[7].split('/')[1]),
-                    'max_price': float(trv_row[7].split('/')[0]),
-                    'dividend_yield': dividend_yield,
-                    'volume': int(trv_row[11].replace(',', '')),
-                    'shares': int(bvb_row[2].replace(',', '')),
-                    'company': bvb_row[1],
-                    'free_float_factor': float(bvb_row[4]),
-                    'representation_factor': float(bvb_row[5]),
-                    'price_correction_factor': float(bvb_row[6]),
-                })
-
-                # Select only the first column from the Tradeville info table.
-                break
+        for bvb_row, tradeville_document in zip(
+            bvb_rows, tradeville_documents
+        ):
+            # Select only the first column from the Tradeville info table.
+            tradeville_tables = TRADEVILLE_XPATH(tradeville_document)
+            if not tradeville_tables:
+                continue
+
+            # Read only the values (the odd cells), not the labels.
+            (
+                last_price,
+                variation,
+                open_price,
+                max_min_price,
+                medium_price,
+                volume,
+                dividend_yield,
+            ) = [
+                data.text_content().strip()
+                for data in tradeville_tables[0][1:14:2]
+            ]
+
+            max_price, min_price = map(to_float, max_min_price.split('/', 1))
+
+            # Some yields are 'n/a'.
+            try:
+                dividend_yield = to_float(dividend_yield)
+            except Exception:
+                dividend_yield = 0
+
+            # Build the list of symbols.
+            symbols_list.append({
+                'symbol': bvb_row[0],
+                'weight': float(bvb_row[7]) / 100.0,
+                'open_price': to_float(open_price),
+                'buy_price': to_float(last_price),
+                'variation': to_float(variation),
+                'medium_price': to_float(medium_price),
+                'min_price': min_price,
+                'max_price': max_price,
+                'dividend_yield': dividend_yield,
+                'volume': to_int(volume),
+                'shares': to_int(bvb_row[2]),
+                'company': bvb_row[1],
+                'free_float_factor': float(bvb_row[4]),
+                'representation_factor': float(bvb_row[5]),
+                'price_correction_factor': float(bvb_row[6]),
+            })
 
         return symbols_list
 
@@ -153,20 +238,27 @@ class Collector:
     def get_html_document(url: str) -> HtmlElement:
         """
             Get the HTML page from an URL.
-            From that page return an HtmlElement structure.
+            From that page return an HtmlElement structure, built while the
+            response is streamed.
 
             If the response failed, an Exception will be raised.
         """
-        response = get(url)
-        response.raise_for_status()
+        with SESSION.get(
+            url, stream=True, timeout=REQUEST_TIMEOUT
+        ) as response:
+            response.raise_for_status()
+
+            # Parse the page while it is received, instead of waiting for it.
+            parser = HTMLParser(**HTML_PARSER_OPTIONS)
+            for chunk in response.iter_content(CHUNK_SIZE):
+                parser.feed(chunk)
 
-        return fromstring(response.content)
+            return parser.close()
 
     @staticmethod
-    def update_mysql_symbols_table(symbols_list: List[Dict]) -> None:
+    def get_mysql_connection() -> MySQLConnection:
         """
-            Update the table from MySQL that is holding symbols informations.
-            *** The insert is based on the order of fields in the dictionary.
+            Connect to MySQL and wait if the database is not ready yet.
         """
         connection = None
 
@@ -182,26 +274,67 @@ class Collector:
                 else:
                     sleep(MYSQL_TIMEOUT)
 
+        return connection
+
+    @staticmethod
+    def update_mysql_symbols_table(
+        connection: MySQLConnection, symbols_list: List[Dict]
+    ) -> None:
+        """
+            Update the table from MySQL that is holding symbols informations.
+        """
         cursor = connection.cursor()
         if not cursor:
-            connection.close()
             return
 
+        # The company is also unique. As REPLACE did, first delete the rows
+        # whose company now belongs to another symbol, so the update below
+        # does not fail on a duplicate company.
+        pairs = [
+            (symbol_dict['symbol'], symbol_dict['company'])
+            for symbol_dict in symbols_list
+        ]
+        if pairs:
+            cursor.execute(
+                'DELETE FROM symbols WHERE company IN ('
+                + ', '.join(['%s'] * len(pairs))
+                + ') AND (symbol, company) NOT IN ('
+                + ', '.join(['(%s, %s)'] * len(pairs))
+                + ')',
+                [company for _, company in pairs]
+                + [value for pair in pairs for value in pair],
+            )
+
+        # The INSERT statements (unlike REPLACE) are batched by executemany
+        # into a single multiple rows statement, so a single round-trip.
+        # The new values are read through the row alias, because VALUES()
+        # in ON DUPLICATE KEY UPDATE is deprecated since MySQL 8.0.20.
         query = (
-            'REPLACE INTO symbols ('
+            'INSERT INTO symbols ('
             'symbol, weight, open_price, buy_price, variation, medium_price,'
             'min_price, max_price, dividend_yield, volume, shares, company, '
             'free_float_factor, representation_factor, price_correction_factor'
             ') VALUES '
-            '(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'
+            '(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) '
+            'AS new ON DUPLICATE KEY UPDATE '
+            'weight = new.weight, open_price = new.open_price, '
+            'buy_price = new.buy_price, variation = new.variation, '
+            'medium_price = new.medium_price, '
+            'min_price = new.min_price, max_price = new.max_price, '
+            'dividend_yield = new.dividend_yield, '
+            'volume = new.volume, shares = new.shares, '
+            'company = new.company, '
+            'free_float_factor = new.free_float_factor, '
+            'representation_factor = new.representation_factor, '
+            'price_correction_factor = new.price_correction_factor'
         )
 
-        for symbol_dict in symbols_list:
-            cursor.execute(query, tuple(symbol_dict.values()))
+        cursor.executemany(query, [
+            SYMBOLS_TABLE_ROW(symbol_dict) for symbol_dict in symbols_list
+        ])
 
         connection.commit()
         cursor.close()
-        connection.close()
 
 
 if __name__ == '__main__':
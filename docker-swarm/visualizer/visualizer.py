@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 
 
-from json import dumps, loads
 from socket import AF_INET, SOCK_STREAM, socket
+from struct import Struct
+from typing import Dict, List
 
 from dash import Dash
 from dash.dependencies import Input, Output, State
@@ -18,6 +19,16 @@ VISUALIZER_ADDRESS = '0.0.0.0'
 
 SERVER_ADDRESS = ('server', 30000)
 
+# Size of the length prefix of every message sent through the socket.
+HEADER_SIZE = 4
+
+# The binary layout of the messages. The visualizer sends the general row
+# (invest amount and transaction fee), followed by the rows of the symbols
+# table (symbol, price, current quantity, buy quantity and order value).
+# The server answers only with the rows of the symbols table.
+GENERAL_ROW = Struct('!dd')
+SYMBOLS_ROW = Struct('!8sdddd')
+
 
 """
     Create the Dash application and the socket for server communication.
@@ -26,6 +37,77 @@ application = Dash(__name__)
 server_socket = socket(AF_INET, SOCK_STREAM)
 
 
+def send_message(payload: bytes) -> None:
+    """
+        Send the payload prefixed by its length (4 bytes, big endian), so the
+        server knows where the message ends in the TCP stream.
+    """
+    server_socket.sendall(len(payload).to_bytes(HEADER_SIZE, 'big') + payload)
+
+
+def receive_exactly(size: int) -> bytes:
+    """
+        Receive exactly size bytes from the server, even if they arrive
+        fragmented in more segments.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+
+    while received < size:
+        count = server_socket.recv_into(view[received:])
+        if not count:
+            raise ConnectionError('The connection was closed.')
+        received += count
+
+    return bytes(buffer)
+
+
+def receive_message() -> bytes:
+    """
+        Receive a message sent by the server (length prefixed).
+    """
+    header = receive_exactly(HEADER_SIZE)
+    return receive_exactly(int.from_bytes(header, 'big'))
+
+
+def pack_symbols_table(symbols_table: List[Dict]) -> bytearray:
+    """
+        Pack the rows of the symbols table, one after the other.
+    """
+    payload = bytearray(len(symbols_table) * SYMBOLS_ROW.size)
+
+    for index, row in enumerate(symbols_table):
+        SYMBOLS_ROW.pack_into(
+            payload,
+            index * SYMBOLS_ROW.size,
+            row['symbol'].encode('ascii'),
+            float(row['price']),
+            float(row['current-quantity']),
+            float(row['buy-quantity']),
+            float(row['order-value']),
+        )
+
+    return payload
+
+
+def unpack_symbols_table(payload: bytes) -> List[Dict]:
+    """
+        Unpack the rows of the symbols table sent by the server.
+    """
+    return [
+        {
+            'symbol': symbol.rstrip(b'\0').decode('ascii'),
+            'price': price,
+            'current-quantity': current_quantity,
+            'buy-quantity': buy_quantity,
+            'order-value': order_value,
+        }
+        for symbol, price, current_quantity, buy_quantity, order_value
+        in SYMBOLS_ROW.iter_unpack(payload)
+    ]
+
+
 @application.callback(
     Output('symbols-table', 'data'),
     [Input('general-table', 'data'), Input('symbols-table', 'data_timestamp')],
@@ -36,20 +118,24 @@ def update_symbols_table(general_table, timestamp, symbols_table):
         The `rows` parameters will contain in the `output-data` the new data.
         Get all this new data and send it to the server to make the calculus.
     """
-    for row in general_table:
-        for value in row.values():
-            if value != 0 and not value:
-                return symbols_table
-
-    for row in symbols_table:
-        for value in row.values():
-            if value != 0 and not value:
-                return symbols_table
+    # Wait until all the cells of both tables are completed.
+    if any(
+        value != 0 and not value
+        for table in (general_table, symbols_table)
+        for row in table
+        for value in row.values()
+    ):
+        return symbols_table
 
     try:
-        server_socket.sendall(dumps(general_table).encode('utf-8'))
-        server_socket.sendall(dumps(symbols_table).encode('utf-8'))
-        symbols_table = loads(server_socket.recv(1024).decode('utf-8'))
+        send_message(
+            GENERAL_ROW.pack(
+                float(general_table[0]['invest-amount']),
+                float(general_table[0]['transaction-fee']),
+            )
+            + pack_symbols_table(symbols_table)
+        )
+        symbols_table = unpack_symbols_table(receive_message())
     except Exception:
         server_socket.close()
         server_socket.connect(SERVER_ADDRESS)
@@ -76,7 +162,7 @@ if __name__ == '__main__':
     """
     # Get the initial data from the server.
     server_socket.connect(SERVER_ADDRESS)
-    symbols_table_data = loads(server_socket.recv(1024).decode('utf-8'))
+    symbols_table_data = unpack_symbols_table(receive_message())
 
     application.layout = Div([
         Div(
@@ -5,30 +5,84 @@ Index from the BVB and Tradeville websites.
     Andrei Răduță andrei.raduta11@gmail.com
 """
 
+from asyncio import gather, run, set_event_loop_policy
 from datetime import datetime
-from json import dump
-from typing import Dict, List
+from hashlib import sha1
+from os import makedirs, path, replace
+from typing import Dict, Iterator, List
 from zoneinfo import ZoneInfo
 
-from lxml.html import fromstring, HtmlElement
-from requests import get
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from lxml.etree import XPath
+from lxml.html import fromstring, HtmlElement, HTMLParser
+from orjson import dumps, loads
+
+# The event loop of uvloop is faster, when it is installed.
+try:
+    from uvloop import EventLoopPolicy, new_event_loop
+except ImportError:
+    from asyncio import DefaultEventLoopPolicy as EventLoopPolicy, new_event_loop
+
+# The loop factory of asyncio.Runner is new in Python 3.11. The older versions
+# select the event loop with its policy.
+try:
+    from asyncio import Runner
+except ImportError:
+    Runner = None
 
 
 BVB_URL: str = "https://www.bvb.ro/FinancialInstruments/Indices/IndicesProfiles.aspx"
-BVB_XPATH: str = '//*[@id="gvC"]//tbody'
+# The XPath expressions are compiled once, at import. The rows of the first
+# table body are limited by the size variable, when evaluated.
+BVB_XPATH: XPath = XPath('(//*[@id="gvC"]//tbody)[1]/*[position() <= $size]')
 
 
 SYMBOL_URL: str = (
     "https://www.bvb.ro/FinancialInstruments/Details/FinancialInstrumentsDetails.aspx?s="
 )
-SYMBOL_XPATH: str = '//*[@id="ctl00_body_ctl02_PricesControl_dvCPrices"]'
+SYMBOL_XPATH: XPath = XPath('//*[@id="ctl00_body_ctl02_PricesControl_dvCPrices"]')
+
+# The labels of the rows read from the symbol table and their keys in data.
+SYMBOL_LABELS: Dict[str, str] = {
+    "Ultimul pret": "buy_price",
+    "Pret deschidere": "open_price",
+    "Pret maxim": "max_price",
+    "Pret minim": "min_price",
+    "Pret mediu": "medium_price",
+    "Var (%)": "variation",
+}
 
 
 SYMBOLS_FILE_NAME: str = "symbols-data.json"
 SYMBOLS_LIST_SIZE: int = 20
 
+# The validators (ETag, Last-Modified) of the pages are kept by URL, next to a
+# copy of each page, to make conditional requests on the next runs.
+VALIDATORS_FILE_NAME: str = "etags.json"
+PAGES_DIRECTORY: str = "pages-cache"
+
+
+TIMEZONE: ZoneInfo = ZoneInfo("Europe/Bucharest")
+TIME_FORMAT: str = "%Y-%m-%d %H:%M:%S"
+
+
+HEADERS: Dict[str, str] = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.3",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Encoding": "br, gzip, deflate",
+}
+REQUEST_TIMEOUT: int = 30
+
+# Only a few tables are read from each page, so skip the ids and comments.
+HTML_PARSER: HTMLParser = HTMLParser(
+    collect_ids=False, remove_comments=True, remove_pis=True
+)
 
-def collect_symbols_data(symbols_list_size: int) -> None:
+# The maximum number of pages requested at the same time.
+CONCURRENT_REQUESTS: int = 8
+
+
+async def collect_symbols_data(symbols_list_size: int) -> None:
     """
     Get the details of the *specified* first elements of the BET Index.
     Use the websites of the Bucharest Stock Exchange and Tradeville.
@@ -58,19 +112,61 @@ def collect_symbols_data(symbols_list_size: int) -> None:
 
     The number before each key is the index of it in the raw data.
     """
-    symbols_list: List[Dict[str, float]] = []
-
-    # Get the list of symbols from the Bucharest Stock Exchange website.
-    bvb_document = get_html_document(url=BVB_URL)
-
+    validators = load_validators()
+
+    # The session reuses the connections (keep-alive) for all the requests
+    # made to BVB and its connector limits the requests made at the same time.
+    async with ClientSession(
+        connector=TCPConnector(limit=CONCURRENT_REQUESTS),
+        headers=HEADERS,
+        timeout=ClientTimeout(total=REQUEST_TIMEOUT),
+    ) as session:
+        # Get the list of symbols from the Bucharest Stock Exchange website.
+        bvb_document = await get_html_document(session, BVB_URL, validators)
+
+        # Extract the data of each cell (HTML TD) from each row (HTML TR).
+        # Get the table with the symbols. Xpath returns the first rows of its tbody.
+        bvb_rows = [
+            [data.text_content().strip() for data in bvb_row]
+            for bvb_row in BVB_XPATH(bvb_document, size=symbols_list_size)
+        ]
+
+        # Get more information about all the symbols at the same time.
+        symbol_documents = await gather(
+            *(
+                get_html_document(session, SYMBOL_URL + bvb_row[0], validators)
+                for bvb_row in bvb_rows
+            )
+        )
+
+    save_validators(validators)
+
+    # The records are written one by one, so the whole list is never built. The
+    # file is replaced only when complete, so it is never read half written.
+    with open(SYMBOLS_FILE_NAME + ".tmp", "wb") as symbols_file:
+        # The first element will be the time of the update.
+        symbols_file.write(b"[")
+        symbols_file.write(dumps({"date": datetime.now(TIMEZONE).strftime(TIME_FORMAT)}))
+
+        for symbol_data in get_symbols_data(bvb_rows, symbol_documents):
+            symbols_file.write(b",")
+            symbols_file.write(dumps(symbol_data))
+
+        symbols_file.write(b"]")
+
+    replace(SYMBOLS_FILE_NAME + ".tmp", SYMBOLS_FILE_NAME)
+
+
+def get_symbols_data(
+    bvb_rows: List[List[str]], symbol_documents: List[HtmlElement]
+) -> Iterator[Dict[str, float]]:
+    """
+    Build the data of each symbol from its BVB row and its details page.
+    """
     # We have this in place because there are scenarios where the sum is bigger than 100.
     weight_total = 100.0
 
-    # Extract the data of each cell (HTML TD) from each row (HTML TR).
-    # Get the table with the symbols. Xpath returns a tbody, so parse it.
-    for bvb_row in bvb_document.xpath(BVB_XPATH)[0][:symbols_list_size]:
-        bvb_row = [data.text_content().strip() for data in bvb_row]
-
+    for bvb_row, symbol_document in zip(bvb_rows, symbol_documents):
         weight = min(round(float(bvb_row[7].replace(",", ".")), 2), weight_total)
         weight_total = round(weight_total - weight, 2)
 
@@ -84,54 +180,84 @@ def collect_symbols_data(symbols_list_size: int) -> None:
             "price_correction_factor": float(bvb_row[6].replace(",", ".")),
         }
 
-        # Get the more information from Tradeville using the symbol name.
-        symbol_document = get_html_document(url=SYMBOL_URL + bvb_row[0])
-        for row in symbol_document.xpath(SYMBOL_XPATH)[0]:
-            if row[0].text == "Ultimul pret":
-                symbol_data["buy_price"] = float(row[1].text.replace(",", "."))
+        for row in SYMBOL_XPATH(symbol_document)[0]:
+            key = SYMBOL_LABELS.get(row[0].text)
+            if key is not None:
+                symbol_data[key] = float(row[1].text.replace(",", "."))
 
-            if row[0].text == "Pret deschidere":
-                symbol_data["open_price"] = float(row[1].text.replace(",", "."))
+        yield symbol_data
 
-            if row[0].text == "Pret maxim":
-                symbol_data["max_price"] = float(row[1].text.replace(",", "."))
 
-            if row[0].text == "Pret minim":
-                symbol_data["min_price"] = float(row[1].text.replace(",", "."))
+async def get_html_document(
+    session: ClientSession, url: str, validators: Dict[str, Dict[str, str]]
+) -> HtmlElement:
+    """
+    Get the HTML document of a web page and parse it using lxml module.
+
+    The request is conditional when a copy of the page was saved before. If the
+    page has not been modified (304), the saved copy is used instead.
+    If the response failed, an Exception will be raised.
+    Further, the information will be extracted using xpath.
+    """
+    page_path = path.join(PAGES_DIRECTORY, sha1(url.encode()).hexdigest() + ".html")
 
-            if row[0].text == "Pret mediu":
-                symbol_data["medium_price"] = float(row[1].text.replace(",", "."))
+    headers: Dict[str, str] = {}
+    if url in validators and path.isfile(page_path):
+        if "ETag" in validators[url]:
+            headers["If-None-Match"] = validators[url]["ETag"]
+        if "Last-Modified" in validators[url]:
+            headers["If-Modified-Since"] = validators[url]["Last-Modified"]
 
-            if row[0].text == "Var (%)":
-                symbol_data["variation"] = float(row[1].text.replace(",", "."))
+    async with session.get(url, headers=headers) as response:
+        if response.status == 304:
+            with open(page_path, "rb") as page_file:
+                return fromstring(page_file.read(), parser=HTML_PARSER)
 
-        # Build the list of symbols.
-        symbols_list.append(symbol_data)
+        response.raise_for_status()
+        content = await response.read()
 
-    # The first element will be the time of the update.
-    symbols_list.insert(
-        0, {"date": str(datetime.now(ZoneInfo("Europe/Bucharest"))).split(".")[0]}
-    )
+        validators[url] = {
+            key: response.headers[key]
+            for key in ("ETag", "Last-Modified")
+            if key in response.headers
+        }
+        if validators[url]:
+            # Replace the saved page only when complete. A truncated copy would
+            # be parsed on every run, as long as the server answers with 304.
+            makedirs(PAGES_DIRECTORY, exist_ok=True)
+            with open(page_path + ".tmp", "wb") as page_file:
+                page_file.write(content)
+            replace(page_path + ".tmp", page_path)
 
-    with open(SYMBOLS_FILE_NAME, "w") as symbols_file:
-        dump(symbols_list, symbols_file)
+        return fromstring(content, parser=HTML_PARSER)
 
 
-def get_html_document(url: str) -> HtmlElement:
+def load_validators() -> Dict[str, Dict[str, str]]:
     """
-    Get the HTML document of a web page and parse it using lxml module.
+    Read the validators of the pages saved on the previous runs, by URL.
+    """
+    try:
+        with open(VALIDATORS_FILE_NAME, "rb") as validators_file:
+            return loads(validators_file.read())
+    except (OSError, ValueError):
+        return {}
 
-    If the response failed, an Exception will be raised.
-    Further, the information will be extracted using xpath.
+
+def save_validators(validators: Dict[str, Dict[str, str]]) -> None:
     """
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.3",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-    }
-    with get(url, headers=headers) as response:
-        response.raise_for_status()
-        return fromstring(response.content)
+    Write the validators of the pages, to be used on the next run.
+    """
+    with open(VALIDATORS_FILE_NAME + ".tmp", "wb") as validators_file:
+        validators_file.write(dumps(validators))
+
+    replace(VALIDATORS_FILE_NAME + ".tmp", VALIDATORS_FILE_NAME)
 
 
 if __name__ == "__main__":
-    collect_symbols_data(symbols_list_size=SYMBOLS_LIST_SIZE)
+    if Runner is not None:
+        with Runner(loop_factory=new_event_loop) as runner:
+            runner.run(collect_symbols_data(symbols_list_size=SYMBOLS_LIST_SIZE))
+
+    else:
+        set_event_loop_policy(EventLoopPolicy())
+        run(collect_symbols_data(symbols_list_size=SYMBOLS_LIST_SIZE))
@@ -13,15 +13,34 @@
     Andrei Răduță andrei.raduta11@gmail.com
 """
 
-from json import loads
-from typing import Any, Dict, List
-
+from functools import lru_cache
+from logging import Logger, getLogger
+from operator import itemgetter
+from threading import Lock, Thread
+from time import monotonic
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
 import requests
 from dash import Dash
 from dash_core_components import Input, Link
 from dash_html_components import B, Div, H1, H2, I, Li, Ol, Table, Td, Tr, Ul
 from dash_table import DataTable
 from dash_table.Format import Format, Scheme
+from urllib3.util import make_headers
+
+try:
+    from orjson import loads
+except ImportError:
+    # The standard parser also reads the bytes of the response, only slower.
+    from json import loads
+
+try:
+    from numba import njit
+except ImportError:
+    # Without Numba, the kernel runs as a plain Python function.
+    def njit(*args, **kwargs):
+        return lambda function: function
 
 
 SYMBOLS_LIST_SIZE = 20
@@ -35,6 +54,201 @@ DATA_URL: str = (
     "https://raw.githubusercontent.com/andreiraduta11/bet-etf/master/"
     "pythonanywhere/symbols-data.json"
 )
+REQUEST_TIMEOUT: int = 10
+# The file is updated at most a few times a day, so GitHub is asked about it
+# only if it was checked more than this many seconds ago.
+DATA_MAX_AGE: int = 10 * 60
+
+# Reuse the connection (keep-alive) to GitHub when the list is fetched again.
+SESSION: requests.Session = requests.Session()
+SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+# Ask for every encoding that urllib3 can decode (brotli, when it is installed) and
+# name the application instead of sending the generic python-requests agent.
+SESSION.headers.update(make_headers(accept_encoding=True, user_agent="bet-etf/1.0"))
+
+# The steps of the calculation are logged only at the DEBUG level. The failed
+# refreshes in background are logged too, as no callback sees them.
+LOGGER: Logger = getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_number_format(precision: int) -> Format:
+    """
+    Get the fixed point format of the numbers, shared by the cells with the same precision.
+    """
+    return Format(precision=precision, scheme=Scheme.fixed)
+
+
+def get_number_datatable_cell(
+    id: str,
+    name: str,
+    editable: bool = False,
+    precision: int = 0,
+    default: int = 0,
+) -> Dict[str, Any]:
+    """
+    Create a Dash DataTable cell with type number.
+    """
+    return {
+        "editable": editable,
+        "format": get_number_format(precision),
+        "id": id,
+        "name": name,
+        "on_change": {"failure": "default"},
+        "type": "numeric",
+        "validation": {"default": default},
+    }
+
+
+# The columns of the symbols table do not change, so they are built once.
+SYMBOLS_DATATABLE_COLUMNS: List[Dict[str, Any]] = [
+    {
+        "id": "symbol",
+        "name": "Symbol",
+        "editable": False,
+        "type": "text",
+    },
+    get_number_datatable_cell(
+        id="weight",
+        name="Index Weight (%)",
+        precision=2,
+    ),
+    get_number_datatable_cell(
+        id="current_quantity",
+        name="Current Quantity",
+        editable=True,
+    ),
+    get_number_datatable_cell(
+        id="variation",
+        name="Price Variation (%)",
+        precision=4,
+    ),
+    get_number_datatable_cell(
+        id="medium_price",
+        name="Medium Price (RON)",
+        precision=4,
+    ),
+    get_number_datatable_cell(
+        id="buy_price",
+        name="Buy Price (RON)",
+        editable=True,
+        precision=4,
+    ),
+    get_number_datatable_cell(
+        id="buy_quantity",
+        name="Buy Quantity",
+    ),
+    get_number_datatable_cell(
+        id="order_value",
+        name="Order Value (RON)",
+        precision=2,
+    ),
+]
+
+
+@njit(cache=True)
+def round_cents(value: float) -> float:
+    """
+    Round a value to 2 decimals, the same as the built-in round. The ties are judged on the
+    exact value, so the rounding error of the scaled value is kept (Dekker's product).
+    Numba's round scales the value first, so it differs on some ties.
+    """
+    scaled = value * 100
+    split = value * 134217729.0
+    high = split - (split - value)
+    error = (high * 100 - scaled) + (value - high) * 100
+
+    rounded = np.floor(scaled)
+    fraction = scaled - rounded
+    if fraction > 0.5 or (fraction == 0.5 and (error > 0 or (error == 0 and rounded % 2))):
+        rounded += 1
+
+    return rounded / 100
+
+
+@njit(cache=True)
+def allocate_orders(
+    buy_prices: np.ndarray,
+    buy_values: np.ndarray,
+    has_order: np.ndarray,
+    total_to_buy: float,
+    weight_order: np.ndarray,
+    price_order: np.ndarray,
+    transaction_fee: float,
+    minimum_order_value: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The numerical core of calculate_orders, working only with arrays aligned with the symbols.
+    The total_to_buy is the sum of the positive buy values. The weight_order and price_order
+    contain the indices of the symbols, sorted ascending by weight and descending by price.
+    The transaction fee is a fraction, not a percent.
+
+    Return the buy quantities and the order values (with the fee) of the symbols.
+    """
+    count = buy_prices.shape[0]
+    buy_values = buy_values.copy()
+    has_order = has_order.copy()
+
+    # The money is distributed proportionally to all the remaining values, so it is the same
+    # as scaling all of them. The array keeps the values divided by the scale, and the total
+    # of the real values is updated with each distribution.
+    scale = 1.0
+    remaining = has_order.sum()
+
+    # First, eliminate the orders that cannot be done because of fee.
+    for index in weight_order:
+        buy_price = buy_prices[index]
+        buy_value = buy_values[index] * scale if has_order[index] else 0.0
+
+        # Make transaction fee-efficient.
+        if (buy_value // buy_price) * buy_price <= minimum_order_value:
+            if has_order[index]:
+                has_order[index] = False
+                remaining -= 1
+            total_to_buy -= buy_value
+
+            # Distribute the money to the remaining symbols.
+            if remaining:
+                scale *= 1 + buy_value / total_to_buy
+                total_to_buy += buy_value
+
+    buy_values *= scale
+    scale = 1.0
+
+    buy_quantities = np.zeros(count)
+    order_values = np.zeros(count)
+    net_factor = 1 - transaction_fee
+    gross_factor = 1 + transaction_fee
+
+    # Calculate the exact values of the buying orders.
+    # Go by price, descending, to use the remainders from each purchase.
+    for index in price_order:
+        buy_price = buy_prices[index]
+        symbol_value = 0.0
+        if has_order[index]:
+            symbol_value = buy_values[index] * scale
+            has_order[index] = False
+            remaining -= 1
+        total_to_buy -= symbol_value
+        buy_value = max(0.0, (symbol_value - 1.49) * net_factor)
+
+        # Calculate the quantity and the value of the order.
+        buy_quantity = buy_value // buy_price
+        order_value = round_cents(buy_quantity * buy_price * gross_factor + 1.49)
+
+        # Make transaction fee-efficient.
+        if order_value <= minimum_order_value:
+            buy_quantity = order_value = 0.0
+
+        # Distribute the remainder from this purchase to the others.
+        if remaining:
+            scale *= 1 + (buy_value - order_value) / total_to_buy
+            total_to_buy += buy_value - order_value
+
+        buy_quantities[index] = buy_quantity
+        order_values[index] = order_value
+
+    return buy_quantities, order_values
 
 
 class DashApplication(Dash):
@@ -43,6 +257,10 @@ class DashApplication(Dash):
 
         self.symbols_time = ""
         self.symbols_list = []
+        self.symbols_data = []
+        self.symbols_etag = ""
+        self.symbols_checked = 0.0
+        self.symbols_lock = Lock()
         self.invest_amount = INVEST_AMOUNT
         self.transaction_fee = TRANSACTION_FEE
 
@@ -64,141 +282,80 @@ class DashApplication(Dash):
 
         This process is done in 2 iterations.
         """
-        actual_portfolio = 0
-        for s in self.symbols_list:
-            actual_portfolio += s.get("buy_price", 0) * s.get("current_quantity", 0)
+        # Work with arrays (one for each column), aligned with the symbols list.
+        # The arrays are filled straight from the dictionaries, without lists.
+        count = len(self.symbols_list)
+        buy_prices = np.fromiter((s["buy_price"] for s in self.symbols_list), float, count)
+        quantities = np.fromiter((s["current_quantity"] for s in self.symbols_list), float, count)
+        weights = np.fromiter((s["weight"] for s in self.symbols_list), float, count)
+
+        values_now = buy_prices * quantities
+        actual_portfolio = float(values_now.sum())
         target_portfolio = actual_portfolio + self.invest_amount
-        print(f"The actual_portfolio is {actual_portfolio}.", flush=True)
+        LOGGER.debug("The actual_portfolio is %s.", actual_portfolio)
 
         # Adapt the weights, because not all the index symbols are included.
         # If 90% of the index is covered, multiplty each weight by (1/0.9).
-        scale_factor = 1.0 / sum(
-            [s.get("weight", 0) / 100.0 for s in self.symbols_list]
-        )
+        scale_factor = 100.0 / float(weights.sum())
+        weights_buy = weights * scale_factor / 100.0
+
+        # Update the weights, considering the new scale_factor.
+        for s, weight_buy in zip(self.symbols_list, (weights_buy * 100.0).tolist()):
+            s["weight_buy"] = weight_buy
 
         # Find the item most further away from what it should actually be. Then we calculate
         # the target portfolio based on that for us to understand what we should buy forward.
-        difference_min = 0
-        for s in self.symbols_list:
-            # Update the weight, considering the new scale_factor.
-            weight = s["weight"]
-            weight_buy = weight * scale_factor / 100.0
-            s.update({"weight": weight, "weight_buy": weight_buy * 100.0})
-
-            value_now = s.get("buy_price", 0) * s.get("current_quantity", 0)
-            value_fut = actual_portfolio * weight_buy
-
-            if (difference := value_fut - value_now) and (difference_min > difference):
-                target_portfolio = value_now / weight_buy
-                difference_min = difference
-        print(f"The target_portfolio is {target_portfolio}.", flush=True)
-
-        # First iteration. Check for differences. Add if they are positive.
-        symbol_to_buy_value: Dict[str, float] = {}
+        differences = actual_portfolio * weights_buy - values_now
+        index_min = int(differences.argmin())
+        if differences[index_min] < 0:
+            target_portfolio = float(values_now[index_min] / weights_buy[index_min])
+        LOGGER.debug("The target_portfolio is %s.", target_portfolio)
 
         # Calculate the normalized value to buy, normalizing to the self.invest_amount.
         # Calculate first how much we need more of a symbol to reach the target.
         total_value_buy: float = target_portfolio - actual_portfolio
         total_value_extra: float = max(0, self.invest_amount - total_value_buy)
-        for s in self.symbols_list:
-            weight_buy = s["weight_buy"] / 100.0
-            value_buy = (target_portfolio * weight_buy) - (
-                s.get("buy_price", 0) * s.get("current_quantity", 0)
-            )
-
-            if total_value_extra:
-                difference = value_buy + total_value_extra * weight_buy
-            else:
-                difference = value_buy / total_value_buy * self.invest_amount
-
-            if difference > 0:
-                symbol_to_buy_value[s.get("symbol")] = difference
+        values_buy = target_portfolio * weights_buy - values_now
 
-        print(f"To buy after 1st pass: {symbol_to_buy_value}.", flush=True)
+        if total_value_extra:
+            differences = values_buy + total_value_extra * weights_buy
+        else:
+            differences = values_buy / total_value_buy * self.invest_amount
 
-        # First, eliminate the orders that cannot be done because of fee.
-        symbols_heap = sorted(self.symbols_list, key=lambda s: s.get("weight"))
-        while symbols_heap:
-            # Get the next symbol with the lowest weight.
-            symbol = symbols_heap.pop(0)
-            symbol_name = symbol["symbol"]
-
-            # Get its current allocated amount of money for purchase.
-            buy_price = symbol.get("buy_price", 0)
-            buy_value = symbol_to_buy_value.get(symbol.get("symbol"), 0)
+        # First iteration. Check for differences. Add if they are positive.
+        has_order = differences > 0
+        symbol_to_buy_value: Dict[str, float] = {
+            s["symbol"]: difference
+            for s, difference, is_positive in zip(
+                self.symbols_list, differences.tolist(), has_order.tolist()
+            )
+            if is_positive
+        }
 
-            # Make transaction fee-efficient.
-            if (buy_value // buy_price) * buy_price <= MINIMUM_ORDER_VALUE:
-                symbol_to_buy_value.pop(symbol.get("symbol"), 0)
+        LOGGER.debug("To buy after 1st pass: %s.", symbol_to_buy_value)
+
+        # The symbols with the lowest weights are eliminated first. The remainders of the
+        # orders are used starting with the highest price.
+        buy_quantities, order_values = allocate_orders(
+            buy_prices,
+            differences,
+            has_order,
+            float(sum(symbol_to_buy_value.values())),
+            np.argsort(weights, kind="stable"),
+            np.argsort(-buy_prices, kind="stable"),
+            self.transaction_fee / 100.0,
+            MINIMUM_ORDER_VALUE,
+        )
 
-                # Distribute the money to the remaining symbols.
-                total_to_buy = sum(symbol_to_buy_value.values())
-                for key in symbol_to_buy_value.keys():
-                    symbol_to_buy_value[key] += buy_value * (
-                        symbol_to_buy_value[key] / total_to_buy
-                    )
+        # Update the columns in the table.
+        for symbol, buy_quantity, order_value in zip(
+            self.symbols_list, buy_quantities.tolist(), order_values.tolist()
+        ):
+            symbol["buy_quantity"] = buy_quantity
+            symbol["order_value"] = order_value
 
-        print(f"To buy after 2nd pass: {symbol_to_buy_value}.", flush=True)
-
-        # Calculate the exact values of the buying orders.
-        # Sort the list by price, to use the remainders from each purchase.
-        symbols_heap = sorted(
-            self.symbols_list, key=lambda s: s.get("buy_price"), reverse=True
-        )
-        print(symbol_to_buy_value)
-        while symbols_heap:
-            # Get the next symbol with the biggest price.
-            symbol = symbols_heap.pop(0)
-            symbol_name = symbol["symbol"]
-
-            # Get its current allocated amount of money for purchase.
-            buy_price = symbol.get("buy_price", 0)
-            buy_value = max(
-                0,
-                (symbol_to_buy_value.pop(symbol_name, 0) - 1.49)
-                * (1 - self.transaction_fee / 100.0),
-            )
-            # Calculate the price, quantity and the value of the order.
-            if buy_price:
-
-                buy_quantity = buy_value // buy_price
-                order = {
-                    "buy_price": buy_price,
-                    "buy_quantity": buy_quantity,
-                    "order_value": round(
-                        buy_quantity * buy_price * (1 + self.transaction_fee / 100.0)
-                        + 1.49,
-                        2,
-                    ),
-                    "symbol": symbol_name,
-                }
-            else:
-                order = {}
-
-            # Make transaction fee-efficient.
-            if order.get("order_value") <= MINIMUM_ORDER_VALUE:
-                order = {"buy_quantity": 0, "order_value": 0}
-            else:
-                print(order)
-
-            # Calculate the value of remaining money after executing the
-            # order for the current symbol. Distribute the rest to the others.
-            remaining = buy_value - order.get("order_value")
-
-            # Distribute the remainder from this purchase.
-            total_to_buy = sum(symbol_to_buy_value.values())
-            for key in symbol_to_buy_value.keys():
-                symbol_to_buy_value[key] += remaining * (
-                    symbol_to_buy_value[key] / total_to_buy
-                )
-
-            # Update the columns in the table.
-            for item in self.symbols_list:
-                if item["symbol"] == symbol_name:
-                    item.update(order)
-                    break
-
-        self.symbols_list = sorted(self.symbols_list, key=lambda s: s.get("symbol"))
+        # Every symbol has its name, so sort the list in place by it.
+        self.symbols_list.sort(key=itemgetter("symbol"))
 
     def collect_symbols_data(self, symbols_list_size: int = SYMBOLS_LIST_SIZE) -> None:
         """
@@ -206,12 +363,57 @@ class DashApplication(Dash):
         Fetch data a personal GitHub file (temporary solution).
         Use the update-symbols-data.sh script to update that public file.
         Use this because PythonAnywhere whitelist for GET requests.
+
+        Only the first call waits for the file. After DATA_MAX_AGE seconds, the file is
+        refreshed in background and the kept data is used meanwhile.
         """
-        response = requests.get(DATA_URL)
+        if not self.symbols_data:
+            with self.symbols_lock:
+                # Another callback could have fetched the file meanwhile.
+                if not self.symbols_data:
+                    self.fetch_symbols_data()
+
+        elif monotonic() - self.symbols_checked > DATA_MAX_AGE:
+            Thread(target=self.refresh_symbols_data, daemon=True).start()
+
+        # The table resets, so copy the symbols (the orders are written in them).
+        symbols_data = self.symbols_data
+        self.symbols_time = symbols_data[0].get("date")
+        self.set_symbols_list([dict(s) for s in symbols_data[1 : symbols_list_size + 1]])
+
+    def refresh_symbols_data(self) -> None:
+        """
+        Check the GitHub file in background. Only one check is made at a time, and a
+        failed check is retried only after DATA_MAX_AGE seconds.
+        """
+        if not self.symbols_lock.acquire(blocking=False):
+            return
+
+        try:
+            # Another thread could have checked the file meanwhile.
+            if monotonic() - self.symbols_checked > DATA_MAX_AGE:
+                self.fetch_symbols_data()
+        except Exception:
+            LOGGER.exception("Failed to refresh the symbols data from %s.", DATA_URL)
+        finally:
+            self.symbols_checked = monotonic()
+            self.symbols_lock.release()
+
+    def fetch_symbols_data(self) -> None:
+        """
+        Check the GitHub file. It is downloaded again only if it was changed (its ETag
+        differs). The caller holds the symbols_lock.
+        """
+        headers = {"If-None-Match": self.symbols_etag} if self.symbols_etag else {}
+        response = SESSION.get(DATA_URL, headers=headers, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
 
-        self.symbols_time = loads(response.content)[0].get("date")
-        self.symbols_list = loads(response.content)[1 : symbols_list_size + 1]
+        # Parse the file only once, and only if it was changed.
+        if response.status_code != 304:
+            self.symbols_data = loads(response.content)
+            self.symbols_etag = response.headers.get("ETag", "")
+
+        self.symbols_checked = monotonic()
 
     def html_init_layout(self) -> None:
         """
@@ -321,49 +523,7 @@ class DashApplication(Dash):
     def html_symbols_datatable(self) -> DataTable:
         return DataTable(
             id="symbols_datatable",
-            columns=[
-                {
-                    "id": "symbol",
-                    "name": "Symbol",
-                    "editable": False,
-                    "type": "text",
-                },
-                self.html_number_datatable_cell(
-                    id="weight",
-                    name="Index Weight (%)",
-                    precision=2,
-                ),
-                self.html_number_datatable_cell(
-                    id="current_quantity",
-                    name="Current Quantity",
-                    editable=True,
-                ),
-                self.html_number_datatable_cell(
-                    id="variation",
-                    name="Price Variation (%)",
-                    precision=4,
-                ),
-                self.html_number_datatable_cell(
-                    id="medium_price",
-                    name="Medium Price (RON)",
-                    precision=4,
-                ),
-                self.html_number_datatable_cell(
-                    id="buy_price",
-                    name="Buy Price (RON)",
-                    editable=True,
-                    precision=4,
-                ),
-                self.html_number_datatable_cell(
-                    id="buy_quantity",
-                    name="Buy Quantity",
-                ),
-                self.html_number_datatable_cell(
-                    id="order_value",
-                    name="Order Value (RON)",
-                    precision=2,
-                ),
-            ],
+            columns=SYMBOLS_DATATABLE_COLUMNS,
             editable=True,
             style_cell={"min-width": "150px"},
             style_data_conditional=[
@@ -387,27 +547,6 @@ class DashApplication(Dash):
             ],
         )
 
-    def html_number_datatable_cell(
-        self,
-        id: str,
-        name: str,
-        editable: bool = False,
-        precision: int = 0,
-        default: int = 0,
-    ) -> Dict[str, Any]:
-        """
-        Create a Dash DataTable cell with type number.
-        """
-        return {
-            "editable": editable,
-            "format": Format(precision=precision, scheme=Scheme.fixed),
-            "id": id,
-            "name": name,
-            "on_change": {"failure": "default"},
-            "type": "numeric",
-            "validation": {"default": default},
-        }
-
     def get_symbols_time(self) -> str:
         if not self.symbols_time:
             return ""
@@ -418,6 +557,11 @@ class DashApplication(Dash):
         return self.symbols_list if self.symbols_list else []
 
     def set_symbols_list(self, symbols_list: List[Dict]) -> None:
+        # The collected symbols have no quantity yet. Add it here, once, so the
+        # calculation reads every column without defaults.
+        for symbol in symbols_list:
+            symbol.setdefault("current_quantity", 0)
+
         self.symbols_list = symbols_list
 
     def set_invest_amount(self, invest_amount: float) -> None: